@@ -0,0 +1,143 @@
+"""
+Read the header of RIFF/AVI files (such as the PICT####.AVI clips written by the trail camera)
+without decoding them.
+
+Only the hdrl and INFO lists at the start of the file are parsed, the movi list holding the frames
+is skipped, so reading a header takes microseconds whatever the size of the clip.
+"""
+
+import mmap
+import os
+import struct
+from datetime import datetime
+
+# Date formats found in the IDIT and ICRD chunks
+_DATE_FORMATS = (
+    '%a %b %d %H:%M:%S %Y',
+    '%Y:%m:%d %H:%M:%S',
+    '%Y/%m/%d %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d',
+)
+
+def _iter_chunks(mm, start, end):
+    """
+    Iterate over the RIFF chunks found between start and end.
+
+    :param mm: The mmap of the file.
+    :param start: Offset of the first chunk.
+    :param end: Offset where the parent list (or the file) ends.
+    :return: A generator of (id, list type or None, data offset, data size) tuples.
+    """
+    offset = start
+    while offset + 8 <= end:
+        chunk_id, size = struct.unpack_from('<4sI', mm, offset)
+        data = offset + 8
+        # Truncated files are common when the camera battery dies, keep what fits
+        size = min(size, end - data)
+        if chunk_id == b'LIST' and size >= 4:
+            yield chunk_id, bytes(mm[data:data + 4]), data + 4, size - 4
+        else:
+            yield chunk_id, None, data, size
+        # Chunks are padded to an even size
+        offset = data + size + (size & 1)
+
+def _has_frame_data(mm, offset):
+    """
+    Tell whether a stream data chunk (a frame, an audio block or an index) starts at offset.
+
+    The declared size of the movi list is not trusted, clips the camera did not finalize leave it at zero.
+    """
+    if offset + 8 > len(mm):
+        return False
+    chunk_id = bytes(mm[offset:offset + 4])
+    if chunk_id == b'LIST':
+        return mm[offset + 8:offset + 12] == b'rec '
+    return chunk_id[:2].isdigit() or chunk_id[:2] == b'ix'
+
+def _parse_date(value):
+    """
+    Parse a date string from an IDIT or ICRD chunk.
+
+    :return: A datetime, or None if the format is unknown.
+    """
+    value = value.split(b'\0', 1)[0].decode('latin-1').strip()
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+def _read_string(mm, data, size):
+    """
+    Read a null-terminated string chunk.
+    """
+    return bytes(mm[data:data + size]).split(b'\0', 1)[0].decode('latin-1').strip()
+
+def read_avi_header(filename):
+    """
+    Read the capture time, duration, resolution and frame count of an AVI file from its header.
+
+    :param filename: Path to the video file.
+    :return: A dictionary with the capture_time (datetime or None), duration (seconds), fps, width, height,
+             frame_count and software (string or None) of the clip, and has_frame_data, whether the movi list
+             holds any chunk. A clip the camera did not finalize can have a frame_count of 0 and still hold
+             frames that decode.
+    :raises ValueError: If the file is not an AVI file.
+    """
+    if os.path.getsize(filename) < 12:
+        raise ValueError(f"{filename} is not an AVI file")
+
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        riff, riff_size, form = struct.unpack_from('<4sI4s', mm, 0)
+        if riff != b'RIFF' or form != b'AVI ':
+            raise ValueError(f"{filename} is not an AVI file")
+
+        header = {
+            'capture_time': None,
+            'duration': 0.0,
+            'fps': 0.0,
+            'width': 0,
+            'height': 0,
+            'frame_count': 0,
+            'software': None,
+            'has_frame_data': False
+        }
+        micro_sec_per_frame = 0
+        stream_frames = 0
+
+        def walk(start, end):
+            nonlocal micro_sec_per_frame, stream_frames
+            for chunk_id, list_type, data, size in _iter_chunks(mm, start, end):
+                if list_type == b'movi' or (chunk_id == b'LIST' and mm[data:data + 4] == b'movi'):
+                    # The frames follow, the header is complete
+                    header['has_frame_data'] = _has_frame_data(mm, data if list_type else data + 4)
+                    return False
+                if list_type is not None:
+                    if walk(data, data + size) is False:
+                        return False
+                elif chunk_id == b'avih' and size >= 40:
+                    (micro_sec_per_frame, _, _, _, header['frame_count'], _, _, _,
+                     header['width'], header['height']) = struct.unpack_from('<10I', mm, data)
+                elif chunk_id == b'strh' and size >= 36 and mm[data:data + 4] == b'vids' and not header['fps']:
+                    scale, rate, _, length = struct.unpack_from('<4I', mm, data + 20)
+                    if scale:
+                        header['fps'] = rate / scale
+                    stream_frames = length
+                elif chunk_id == b'IDIT' or (chunk_id == b'ICRD' and header['capture_time'] is None):
+                    header['capture_time'] = _parse_date(bytes(mm[data:data + size])) or header['capture_time']
+                elif chunk_id == b'ISFT':
+                    header['software'] = _read_string(mm, data, size)
+            return True
+
+        # Unfinalized clips leave the RIFF size at zero
+        walk(12, min(len(mm), 8 + riff_size) if riff_size else len(mm))
+
+    # The avih frame count only covers the first RIFF chunk of OpenDML files
+    header['frame_count'] = max(header['frame_count'], stream_frames)
+    if not header['fps'] and micro_sec_per_frame:
+        header['fps'] = 1000000.0 / micro_sec_per_frame
+    if header['fps']:
+        header['duration'] = header['frame_count'] / header['fps']
+    return header
@@ -0,0 +1,84 @@
+"""
+Compare the speed and the accuracy of the background models of mvmt_detector.
+
+Without a folder, synthetic clips with a known ground truth are generated in a temporary folder.
+With a folder of real clips, the verdicts of the MOG2 backend are used as the reference.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import mvmt_detector
+import synthetic_clips
+
+def benchmark_backend(filepaths, backend, threshold=1000, frame_stride=1, scale=1.0):
+    """
+    Scan clips with one backend.
+
+    :param filepaths: Paths of the clips to scan.
+    :param backend: The backend to use.
+    :param threshold: The contour area threshold.
+    :param frame_stride: The frame stride passed to movement_scan.
+    :param scale: The scale passed to movement_scan.
+    :return: A (verdicts, elapsed seconds) tuple, verdicts mapping each path to True if motion was detected.
+    """
+    verdicts = {}
+    start = time.perf_counter()
+    for filepath in filepaths:
+        verdicts[filepath] = mvmt_detector.movement_scan(filepath, threshold, frame_stride=frame_stride,
+                                                         scale=scale, backend=backend)
+    return verdicts, time.perf_counter() - start
+
+def compare_backends(filepaths, truth=None, threshold=1000, frame_stride=1, scale=1.0):
+    """
+    Scan the clips with every backend and print their speed and accuracy.
+
+    :param filepaths: Paths of the clips to scan.
+    :param truth: A dictionary mapping each path to its expected verdict. Defaults to the MOG2 verdicts.
+    :param threshold: The contour area threshold.
+    :param frame_stride: The frame stride passed to movement_scan.
+    :param scale: The scale passed to movement_scan.
+    :return: A dictionary mapping each backend to its (accuracy, elapsed seconds).
+    """
+    runs = {backend: benchmark_backend(filepaths, backend, threshold, frame_stride, scale)
+            for backend in mvmt_detector.BACKENDS}
+    reference = truth if truth is not None else runs['mog2'][0]
+
+    summary = {}
+    print(f"\n{'backend':<8} {'clips/s':>8} {'accuracy':>9} {'missed':>7} {'false':>6}")
+    for backend, (verdicts, elapsed) in runs.items():
+        missed = sum(1 for path in filepaths if reference[path] and not verdicts[path])
+        false_alarms = sum(1 for path in filepaths if verdicts[path] and not reference[path])
+        accuracy = 1.0 - (missed + false_alarms) / max(1, len(filepaths))
+        summary[backend] = (accuracy, elapsed)
+        print(f"{backend:<8} {len(filepaths) / elapsed:>8.2f} {accuracy:>9.1%} {missed:>7} {false_alarms:>6}")
+
+    for path in filepaths:
+        row = ' '.join(f"{backend}={runs[backend][0][path]!s:<5}" for backend in runs)
+        print(f"  {os.path.basename(path):<32} expected={reference[path]!s:<5} {row}")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the motion detection backends")
+    parser.add_argument('folder', nargs='?', help="Folder of real clips, MOG2 is used as the reference")
+    parser.add_argument('--extensions', default='.mp4,.AVI', help="Extensions of the clips to scan")
+    parser.add_argument('--threshold', type=float, default=1000, help="Contour area threshold (default: 1000)")
+    parser.add_argument('--stride', type=int, default=1, help="Analyse only every Nth frame (default: 1)")
+    parser.add_argument('--scale', type=float, default=1.0, help="Resize factor applied to frames (default: 1.0)")
+    args = parser.parse_args()
+
+    if args.folder:
+        extensions = tuple(args.extensions.split(','))
+        filepaths = [os.path.join(args.folder, filename) for filename in sorted(os.listdir(args.folder))
+                     if filename.endswith(extensions)]
+        compare_backends(filepaths, None, args.threshold, args.stride, args.scale)
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        truth = synthetic_clips.generate_clips(folder)
+        compare_backends(sorted(truth), truth, args.threshold, args.stride, args.scale)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Reproducible benchmarks of the scanning and redating scripts, on synthetic clips with a known ground truth.
+
+The clips are written by synthetic_clips.py in a temporary folder and the dates are written through
+fake_exiftool.py, so the suite needs neither real footage nor the exiftool binary. Each benchmark reports its
+throughput and peak memory and checks its results, so a speed-up cannot quietly break the detection or the
+redating: the motion verdicts are compared with the ground truth, missed clips failing the check and false
+alarms being reported, and the dates of the redated files are read back and compared with the expected ones.
+The peak memory and the duration are measured in separate passes, tracemalloc slowing the code down.
+
+    python benchmark_suite.py --repeat 4 --extensions .AVI,.mp4 --delay 0.02 --output benchmark.json
+
+The exit status is 1 when a check fails.
+"""
+
+import argparse
+import contextlib
+import csv
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where only the memory allocated through Python is reported
+    resource = None
+
+import mp4_dates
+import mvmt_detector
+import original_index
+import redate_videos
+import synthetic_clips
+
+# The exiftool stand-in shipped with the scripts
+FAKE_EXIFTOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_exiftool.py')
+
+def _max_rss():
+    """
+    Peak resident memory of the process so far in bytes, or None where it cannot be read.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+def measure(function, *args, setup=None, quiet=True, **kwargs):
+    """
+    Call a function and measure its duration and peak memory, in two separate passes.
+
+    tracemalloc slows down every allocation, so the peak memory is measured in a first pass and the duration in
+    a second one without it. The peak is the largest amount of memory allocated through Python during the call,
+    NumPy frames included. The buffers of the OpenCV decoders and of worker processes are not traced, the peak
+    resident memory of the process is reported for them.
+
+    :param function: The function to call with the remaining arguments.
+    :param setup: Function called before each pass to prepare fresh inputs, for functions that change their
+                  inputs. It returns a dictionary of keyword arguments added to the call, or None.
+    :param quiet: Hide what the function prints.
+    :return: A (result of the timed pass, elapsed seconds, peak bytes) tuple.
+    """
+    def run():
+        call_kwargs = dict(kwargs, **(setup() or {})) if setup is not None else kwargs
+        gc.collect()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            start = time.perf_counter()
+            result = function(*args, **call_kwargs)
+            return result, time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result, elapsed = run()
+    return result, elapsed, peak
+
+def check_verdicts(verdicts, truth):
+    """
+    Compare motion verdicts with the ground truth.
+
+    Only missed clips fail the check: a false alarm costs a look at the clip, a missed one loses it.
+
+    :param verdicts: A dictionary mapping each clip path to its verdict.
+    :param truth: A dictionary mapping each clip path to True if it contains motion.
+    :return: A dictionary with the number of clips, missed clips, false alarms and the recall.
+    """
+    missed = sorted(path for path, motion in truth.items() if motion and verdicts.get(path) is not True)
+    false_alarms = sorted(path for path, motion in truth.items() if not motion and verdicts.get(path) is not False)
+    with_motion = sum(1 for motion in truth.values() if motion)
+    return {'clips': len(truth), 'missed': missed, 'false_alarms': false_alarms,
+            'recall': 1.0 - len(missed) / max(1, with_motion), 'passed': not missed}
+
+def _same_date(value, expected):
+    """
+    Tell if a date read by ExifTool is the expected one, comparing wall-clock times when either has no timezone.
+    """
+    dates = []
+    for text in (str(value).split('.')[0], expected):
+        for date_format in ('%Y:%m:%d %H:%M:%S%z', '%Y:%m:%d %H:%M:%S'):
+            try:
+                dates.append(datetime.strptime(text, date_format))
+                break
+            except ValueError:
+                continue
+        else:
+            return False
+    read, expected = dates
+    if read.tzinfo is None or expected.tzinfo is None:
+        return read.replace(tzinfo=None) == expected.replace(tzinfo=None)
+    return read == expected
+
+def check_write_plan(plan):
+    """
+    Check that the files of an executed write plan have the dates of the plan.
+
+    The dates are read back from the files rather than with the redating code under test: the modification
+    time of the file, the File:FileCreateDate reported by ExifTool (where the system has creation times) and
+    the QuickTime dates of the MP4/MOV files, read from their movie header.
+
+    :param plan: The write plan, see redate_videos.execute_write_plan().
+    :return: A dictionary with the number of files and the paths of those with other dates.
+    """
+    filenames = [entry['filename'] for entry in plan]
+    mismatched = []
+    for entry, tags in zip(plan, redate_videos.get_videos_tags(filenames, ['File:FileCreateDate'])):
+        filename = entry['filename']
+        matches = abs(os.stat(filename).st_mtime - entry['times'][1]) < 1
+        if 'File:FileCreateDate' in tags:
+            matches = matches and _same_date(tags['File:FileCreateDate'], entry['tags']['File:FileCreateDate'])
+        if 'quicktime' in entry and filename.lower().endswith(('.mp4', '.mov')):
+            dates = mp4_dates.read_quicktime_dates(filename)
+            create_date, modify_date, _ = entry['quicktime']
+            matches = (matches and dates is not None and dates['create_date'] == create_date.replace(tzinfo=None)
+                       and dates['modify_date'] == modify_date.replace(tzinfo=None))
+        if not matches:
+            mismatched.append(filename)
+    return {'files': len(plan), 'mismatched': mismatched, 'passed': not mismatched}
+
+def benchmark_movement_scan(truth, frame_count, **options):
+    """
+    Scan the clips one by one with movement_scan.
+
+    :param truth: A dictionary mapping each clip path to True if it contains motion.
+    :param frame_count: Number of frames of each clip.
+    :param options: The options passed to movement_scan (threshold, frame_stride, scale, backend, ...).
+    :return: A dictionary with the measures and the accuracy check.
+    """
+    def scan():
+        return {path: mvmt_detector.movement_scan(path, **options) for path in sorted(truth)}
+
+    verdicts, elapsed, peak = measure(scan)
+    return {'benchmark': 'movement_scan', 'elapsed': elapsed, 'clips_per_s': len(truth) / elapsed,
+            'frames_per_s': len(truth) * frame_count / elapsed, 'peak_bytes': peak, 'max_rss_bytes': _max_rss(),
+            'check': check_verdicts(verdicts, truth)}
+
+def benchmark_scan_folder(folder_path, truth, frame_count, extensions, workers=1, **options):
+    """
+    Scan a folder with scan_folder, without its index, and read back the verdicts of its results.csv.
+
+    :param folder_path: The folder of the clips.
+    :param truth: A dictionary mapping each clip path to True if it contains motion.
+    :param frame_count: Number of frames of each clip.
+    :param extensions: The extensions passed to scan_folder.
+    :param workers: Number of worker processes.
+    :param options: The other options passed to scan_folder.
+    :return: A dictionary with the measures and the accuracy check.
+    """
+    _, elapsed, peak = measure(mvmt_detector.scan_folder, folder_path, extensions, workers=workers, use_index=False,
+                               **options)
+    with open('results.csv', newline='') as file:
+        verdicts = {row['Filename']: {'True': True, 'False': False}.get(row['Movement Detected'])
+                    for row in csv.DictReader(file)}
+    return {'benchmark': f'scan_folder ({workers} worker{"s" if workers > 1 else ""})', 'elapsed': elapsed,
+            'clips_per_s': len(truth) / elapsed, 'frames_per_s': len(truth) * frame_count / elapsed,
+            'peak_bytes': peak, 'max_rss_bytes': _max_rss(), 'check': check_verdicts(verdicts, truth)}
+
+def _set_capture_dates(paths, first_date=datetime(2022, 6, 1, 6, 0)):
+    """
+    Give the clips distinct modification dates in the past, one hour apart, so every redated file has work to do.
+    """
+    for i, path in enumerate(sorted(paths)):
+        timestamp = (first_date + timedelta(hours=i)).timestamp()
+        os.utime(path, (timestamp, timestamp))
+
+def benchmark_match_and_update_dates(original_folder, converted_folder, workers=1):
+    """
+    Copy the clips as HandBrake would name them and copy the dates of the originals back with
+    match_and_update_dates.
+
+    :param original_folder: The folder of the original clips.
+    :param converted_folder: The folder where the converted copies are written, a subfolder per measure pass.
+    :param workers: Number of exiftool processes.
+    :return: A dictionary with the measures and the dates check.
+    """
+    passes = []
+
+    def setup():
+        folder = os.path.join(converted_folder, f'pass{len(passes) + 1}')
+        passes.append(folder)
+        os.makedirs(folder)
+        for path in original_index.list_videos(original_folder):
+            # HandBrake replaces the underscores with spaces and adds a "-1" suffix
+            name, extension = os.path.splitext(os.path.basename(path))
+            shutil.copyfile(path, os.path.join(folder, name.replace('_', ' ') + '-1' + extension))
+        return {'converted_folder': folder, 'report_file': os.path.join(folder, 'match_report.csv')}
+
+    results, elapsed, peak = measure(redate_videos.match_and_update_dates, original_folder, workers=workers,
+                                     setup=setup)
+    pairs = original_index.match_folder(original_folder, passes[-1])
+    dates = redate_videos.get_videos_dates([original_path for original_path, _ in pairs])
+    plan = [redate_videos.plan_video_dates(converted_path, dates[original_path])
+            for original_path, converted_path in pairs]
+    return _redate_result(f'match_and_update_dates ({workers} exiftool)', results, elapsed, peak,
+                          check_write_plan(plan))
+
+def benchmark_batch_date_change(original_folder, renamed_folder, workers=1, offset_days=4206.32):
+    """
+    Copy the clips under new names, list them in a renaming CSV file and redate them with batch_date_change.
+
+    :param original_folder: The folder of the original clips.
+    :param renamed_folder: The folder where the renamed copies are written, a subfolder per measure pass.
+    :param workers: Number of exiftool processes.
+    :param offset_days: The offset passed to batch_date_change.
+    :return: A dictionary with the measures and the dates check.
+    """
+    rows = [[os.path.basename(path), '', f'content_{i + 1:04d}{os.path.splitext(path)[1]}']
+            for i, path in enumerate(original_index.list_videos(original_folder))]
+    passes = []
+
+    def setup():
+        folder = os.path.join(renamed_folder, f'pass{len(passes) + 1}')
+        passes.append(folder)
+        done_folder = os.path.join(folder, 'done')
+        os.makedirs(done_folder)
+        for old_name, _, new_name in rows:
+            shutil.copyfile(os.path.join(original_folder, old_name), os.path.join(folder, new_name))
+        csv_path = os.path.join(folder, 'renamed_files_new.csv')
+        with open(csv_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Old Name", "Date", "New Name"])
+            writer.writerows(rows)
+        return {'csv_path': csv_path, 'renamed_folder': folder, 'done_folder': done_folder}
+
+    results, elapsed, peak = measure(redate_videos.batch_date_change, workers=workers,
+                                     original_folder=original_folder, offset_days=offset_days, setup=setup)
+    old_paths = [os.path.join(original_folder, row[0]) for row in rows]
+    old_dates = {path: redate_videos.get_avi_capture_date(path) for path in old_paths}
+    missing = [path for path, date in old_dates.items() if date is None]
+    for path, tags in zip(missing, redate_videos.get_videos_tags(missing, ['File:FileModifyDate'])):
+        old_dates[path] = tags.get('File:FileModifyDate')
+    plan = [redate_videos.plan_video_dates_change(
+                os.path.join(passes[-1], row[2]),
+                datetime.strptime(old_dates[old_path], '%Y:%m:%d %H:%M:%S%z') + timedelta(days=offset_days))
+            for row, old_path in zip(rows, old_paths)]
+    return _redate_result(f'batch_date_change ({workers} exiftool)', results, elapsed, peak, check_write_plan(plan))
+
+def _redate_result(name, results, elapsed, peak, check):
+    failed = [filename for filename, success, _ in results if not success]
+    check = dict(check, failed=failed, passed=check['passed'] and not failed)
+    return {'benchmark': name, 'elapsed': elapsed, 'files_per_s': len(results) / elapsed, 'peak_bytes': peak,
+            'max_rss_bytes': _max_rss(), 'check': check}
+
+def _describe_check(check):
+    if 'clips' in check:
+        return (f"recall {check['recall']:.0%}, {len(check['missed'])} missed, "
+                f"{len(check['false_alarms'])} false alarms")
+    return f"{check['files'] - len(check['mismatched'])}/{check['files']} dates, {len(check['failed'])} failed"
+
+def print_report(results):
+    """
+    Print the measures and checks of the benchmarks, and the clips or files that failed their check.
+    """
+    print(f"\n{'benchmark':<36} {'seconds':>8} {'clips/s':>8} {'frames/s':>9} {'files/s':>8} "
+          f"{'peak MB':>8} {'RSS MB':>7}  check")
+    for result in results:
+        rates = [f"{result[key]:.1f}" if key in result else '-' for key in ('clips_per_s', 'frames_per_s', 'files_per_s')]
+        rss = f"{result['max_rss_bytes'] / 2 ** 20:.0f}" if result['max_rss_bytes'] is not None else '-'
+        status = 'ok' if result['check']['passed'] else 'FAILED'
+        print(f"{result['benchmark']:<36} {result['elapsed']:>8.2f} {rates[0]:>8} {rates[1]:>9} {rates[2]:>8} "
+              f"{result['peak_bytes'] / 2 ** 20:>8.1f} {rss:>7}  {status}: {_describe_check(result['check'])}")
+    for result in results:
+        check = result['check']
+        for key in ('missed', 'false_alarms', 'mismatched', 'failed'):
+            for path in check.get(key, []):
+                print(f"  {result['benchmark']}: {key.replace('_', ' ')} {os.path.basename(path)}")
+
+def run_suite(root, extensions=('.AVI', '.mp4'), repeat=2, size=(320, 240), frame_count=90, threshold=1000,
+              scan_workers=(1, 2), exiftool_workers=(1, 4), scan_options=None):
+    """
+    Generate the synthetic clips in a folder and run every benchmark on them.
+
+    :param root: An empty work folder. The results.csv of scan_folder is written in the current folder.
+    :param extensions: The containers of the clips, a set of clips being written for each.
+    :param repeat: Number of clips written per case and container, see synthetic_clips.generate_clips().
+    :param size: The (width, height) of the frames.
+    :param frame_count: Number of frames of each clip.
+    :param threshold: The contour area threshold of the detector.
+    :param scan_workers: The numbers of worker processes scan_folder is benchmarked with.
+    :param exiftool_workers: The numbers of exiftool processes the redating is benchmarked with.
+    :param scan_options: Other options of the detector (frame_stride, scale, backend, ...).
+    :return: The list of results, one dictionary per benchmark.
+    """
+    scan_options = dict(scan_options or {}, threshold=threshold)
+    original_folder = os.path.join(root, 'originals')
+    truth = {}
+    for extension in extensions:
+        truth.update(synthetic_clips.generate_clips(original_folder, extension, size, frame_count=frame_count,
+                                                    repeat=repeat))
+    _set_capture_dates(truth)
+    print(f"{len(truth)} clips of {frame_count} frames at {size[0]}x{size[1]} in {original_folder}")
+
+    results = [benchmark_movement_scan(truth, frame_count, **scan_options)]
+    for workers in scan_workers:
+        results.append(benchmark_scan_folder(original_folder, truth, frame_count, ','.join(extensions), workers,
+                                             **scan_options))
+    for workers in exiftool_workers:
+        results.append(benchmark_match_and_update_dates(original_folder, os.path.join(root, f'converted_{workers}'),
+                                                        workers))
+        results.append(benchmark_batch_date_change(original_folder, os.path.join(root, f'renamed_{workers}'),
+                                                   workers))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scanning and redating scripts on synthetic clips")
+    parser.add_argument('--extensions', default='.AVI,.mp4', help="Containers of the clips (default: .AVI,.mp4)")
+    parser.add_argument('--repeat', type=int, default=2, help="Clips written per case and container (default: 2)")
+    parser.add_argument('--size', default='320x240', help="Frame size as WIDTHxHEIGHT (default: 320x240)")
+    parser.add_argument('--frames', type=int, default=90, help="Frames per clip (default: 90)")
+    parser.add_argument('--threshold', type=float, default=1000, help="Contour area threshold (default: 1000)")
+    parser.add_argument('--stride', type=int, default=1, help="Analyse only every Nth frame (default: 1)")
+    parser.add_argument('--scale', type=float, default=1.0, help="Resize factor applied to frames (default: 1.0)")
+    parser.add_argument('--backend', choices=mvmt_detector.BACKENDS, default='mog2', help="Background model")
+    parser.add_argument('--scan-workers', default='1,2', help="Worker processes of scan_folder (default: 1,2)")
+    parser.add_argument('--exiftool-workers', default='1,4', help="Exiftool processes of the redating (default: 1,4)")
+    parser.add_argument('--exiftool', help="Benchmark a real exiftool executable instead of fake_exiftool.py")
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help="Seconds fake_exiftool.py spends per file, to simulate the real exiftool (default: 0)")
+    parser.add_argument('--output', help="JSON file where the results are written, to compare runs")
+    parser.add_argument('--keep', help="Folder where the clips are written and kept, instead of a temporary one")
+    args = parser.parse_args()
+
+    size = tuple(int(value) for value in args.size.lower().split('x'))
+    scan_options = {'frame_stride': args.stride, 'scale': args.scale, 'backend': args.backend}
+    with contextlib.ExitStack() as stack:
+        root = os.path.abspath(args.keep) if args.keep else stack.enter_context(tempfile.TemporaryDirectory())
+        if args.keep and os.path.exists(root) and os.listdir(root):
+            parser.error(f"{args.keep} is not empty")
+        if args.exiftool:
+            redate_videos.EXIFTOOL_PATH = args.exiftool
+        else:
+            redate_videos.EXIFTOOL_PATH = FAKE_EXIFTOOL
+            os.environ['FAKE_EXIFTOOL_DB'] = os.path.join(root, 'fake_exiftool')
+            os.environ['FAKE_EXIFTOOL_DELAY'] = str(args.delay)
+        # scan_folder writes its results.csv in the current folder
+        work_folder = os.path.join(root, 'work')
+        os.makedirs(work_folder)
+        cwd = os.getcwd()
+        os.chdir(work_folder)
+        stack.callback(os.chdir, cwd)
+
+        results = run_suite(root, tuple(args.extensions.split(',')), args.repeat, size, args.frames, args.threshold,
+                            [int(value) for value in args.scan_workers.split(',')],
+                            [int(value) for value in args.exiftool_workers.split(',')], scan_options)
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'date': datetime.now().isoformat(timespec='seconds'), 'options': vars(args),
+                       'results': results}, file, indent=2)
+    return 0 if all(result['check']['passed'] for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the exiftool executable, to run and benchmark the redating scripts without the real binary.
+
+It speaks the subset of the exiftool command line used through PyExifTool: -stay_open with an argument
+file on stdin, -common_args, -execute sections with their {ready} markers, -echo4 with ${status}, -ver,
+-j reads of tags and -TAG=VALUE writes, and -overwrite_original. Point EXIFTOOL_PATH at this file (it must
+be executable) to use it:
+
+    EXIFTOOL_PATH=./fake_exiftool.py python redate_videos.py
+
+The File dates are the real filesystem times, except File:FileCreateDate which is reported like on Windows on
+every platform and, once written, kept like the other tags in a JSON sidecar per file, in the folder given by
+the FAKE_EXIFTOOL_DB environment variable. The
+QuickTime:CreateDate and QuickTime:ModifyDate of MP4/MOV files are read and written in the movie header, and
+QuickTime tags are not written to other files.
+Writing other tags than the File ones leaves an *_original backup like exiftool does. FAKE_EXIFTOOL_DELAY
+adds a delay in seconds per file, to simulate the cost of the real exiftool.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import mp4_dates
+
+# Version reported by -ver, PyExifTool requires 12.15 or later
+VERSION = '12.76'
+
+# Folder holding the tags written to each file
+DB_FOLDER = os.environ.get('FAKE_EXIFTOOL_DB', os.path.join(tempfile.gettempdir(), 'fake_exiftool'))
+
+# Delay in seconds spent on each file
+DELAY = float(os.environ.get('FAKE_EXIFTOOL_DELAY', '0'))
+
+# Tags stored in the movie header of MP4/MOV files, with their field in mp4_dates
+QUICKTIME_TAGS = {'QuickTime:CreateDate': 'create_date', 'QuickTime:ModifyDate': 'modify_date'}
+
+def _sidecar_path(filename):
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(DB_FOLDER, key + '.json')
+
+def _load_sidecar(filename):
+    try:
+        with open(_sidecar_path(filename), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def _save_sidecar(filename, tags):
+    path = _sidecar_path(filename)
+    os.makedirs(DB_FOLDER, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(tags, file)
+    os.replace(tmp_path, path)
+
+def _format_time(timestamp):
+    value = datetime.fromtimestamp(timestamp).astimezone().strftime('%Y:%m:%d %H:%M:%S%z')
+    # exiftool writes the timezone offset with a colon
+    return value[:-2] + ':' + value[-2:]
+
+def _parse_date(value):
+    value = re.sub(r'\.\d+', '', value.strip())
+    for date_format in ('%Y:%m:%d %H:%M:%S%z', '%Y:%m:%d %H:%M:%S'):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid date/time (use YYYY:mm:dd HH:MM:SS[.ss][+/-HH:MM|Z]) - {value}")
+
+def _is_quicktime(filename):
+    return filename.lower().endswith(('.mp4', '.mov'))
+
+def read_tags(filename):
+    """
+    Read the tags of a file, keyed by group and name.
+    """
+    stat = os.stat(filename)
+    tags = {
+        'File:FileName': os.path.basename(filename),
+        'File:Directory': os.path.dirname(filename) or '.',
+        'File:FileSize': stat.st_size,
+        'File:FileModifyDate': _format_time(stat.st_mtime),
+        'File:FileAccessDate': _format_time(stat.st_atime),
+    }
+    # Reported on every platform like on Windows, where the scripts run
+    tags['File:FileCreateDate'] = _format_time(getattr(stat, 'st_birthtime', stat.st_ctime))
+    if _is_quicktime(filename):
+        dates = mp4_dates.read_quicktime_dates(filename)
+        if dates is not None:
+            for tag, field in QUICKTIME_TAGS.items():
+                date = dates[field]
+                tags[tag] = date.strftime('%Y:%m:%d %H:%M:%S') if date is not None else '0000:00:00 00:00:00'
+    tags.update(_load_sidecar(filename))
+    return tags
+
+def write_tags(filename, values, overwrite_original=False):
+    """
+    Write tags to a file.
+
+    :return: True if the file was updated, False if it already had these values.
+    """
+    current = read_tags(filename)
+    # Like exiftool, QuickTime tags cannot be written to other containers and are left out
+    if not _is_quicktime(filename):
+        values = {tag: value for tag, value in values.items() if not tag.startswith('QuickTime:')}
+    changed = {tag: value for tag, value in values.items() if str(current.get(tag)) != value}
+    if not changed:
+        return False
+
+    embedded = {tag: value for tag, value in changed.items() if not tag.startswith('File:')}
+    if embedded:
+        backup = filename + '_original'
+        if not overwrite_original and not os.path.exists(backup):
+            shutil.copy2(filename, backup)
+        quicktime = {field: _parse_date(embedded[tag]) for tag, field in QUICKTIME_TAGS.items() if tag in embedded}
+        dates = mp4_dates.read_quicktime_dates(filename) if quicktime and _is_quicktime(filename) else None
+        if dates is not None:
+            dates.update(quicktime)
+            # A date left at zero takes the value of the other one
+            create_date = dates['create_date'] or dates['modify_date']
+            modify_date = dates['modify_date'] or dates['create_date']
+            mp4_dates.write_quicktime_dates(filename, create_date, modify_date, (b'mvhd',))
+            embedded = {tag: value for tag, value in embedded.items() if tag not in QUICKTIME_TAGS}
+        # Rewriting the file changes its modification time
+        os.utime(filename)
+
+    sidecar = _load_sidecar(filename)
+    sidecar.update(embedded)
+    if 'File:FileCreateDate' in changed:
+        sidecar['File:FileCreateDate'] = changed['File:FileCreateDate']
+    if embedded or 'File:FileCreateDate' in changed:
+        _save_sidecar(filename, sidecar)
+
+    if 'File:FileModifyDate' in changed:
+        modify_time = _parse_date(changed['File:FileModifyDate']).timestamp()
+        os.utime(filename, (os.stat(filename).st_atime, modify_time))
+    return True
+
+def run_command(args, out, err):
+    """
+    Run one exiftool command.
+
+    :return: The exit status, 0 on success and 1 when a file had an error.
+    """
+    files, reads, writes = [], [], {}
+    options = set()
+    echo = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '-echo4':
+            echo.append(args[i + 1])
+            i += 1
+        elif arg in ('-ver', '-j', '-G', '-n', '-overwrite_original', '-q'):
+            options.add(arg)
+        elif arg.startswith('-') and '=' in arg:
+            tag, value = arg[1:].split('=', 1)
+            writes[tag] = value
+        elif arg.startswith('-'):
+            reads.append(arg[1:])
+        else:
+            files.append(arg)
+        i += 1
+
+    status = 0
+    if '-ver' in options:
+        out.write(VERSION + '\n')
+    elif writes:
+        updated = unchanged = errors = 0
+        for filename in files:
+            time.sleep(DELAY)
+            if not os.path.isfile(filename):
+                err.write(f"Error: File not found - {filename}\n")
+                errors += 1
+                continue
+            try:
+                if write_tags(filename, writes, '-overwrite_original' in options):
+                    updated += 1
+                else:
+                    unchanged += 1
+            except (OSError, ValueError) as e:
+                err.write(f"Error: {e} - {filename}\n")
+                errors += 1
+        out.write(f"    {updated} image files updated\n")
+        if unchanged:
+            out.write(f"    {unchanged} image files unchanged\n")
+        if errors:
+            out.write(f"    {errors} files weren't updated due to errors\n")
+            status = 1
+    else:
+        records = []
+        for filename in files:
+            time.sleep(DELAY)
+            if not os.path.isfile(filename):
+                err.write(f"Error: File not found - {filename}\n")
+                status = 1
+                continue
+            tags = read_tags(filename)
+            if reads:
+                wanted = {tag: value for tag, value in tags.items()
+                          if any(tag == read or tag.split(':', 1)[1] == read for read in reads)}
+            else:
+                wanted = tags
+            record = {'SourceFile': filename}
+            for tag, value in wanted.items():
+                record[tag if '-G' in options else tag.split(':', 1)[1]] = value
+            records.append(record)
+        if '-j' in options:
+            if records:
+                out.write(json.dumps(records, indent=2) + '\n')
+        else:
+            for record in records:
+                for tag, value in record.items():
+                    if tag != 'SourceFile':
+                        out.write(f"{tag:<32}: {value}\n")
+
+    for text in echo:
+        err.write(text.replace('${status}', str(status)) + '\n')
+    return status
+
+def main(argv):
+    common_args = argv[argv.index('-common_args') + 1:] if '-common_args' in argv else []
+    if '-stay_open' not in argv:
+        return run_command(argv + common_args, sys.stdout, sys.stderr)
+
+    args = []
+    for line in sys.stdin:
+        line = line.rstrip('\r\n')
+        if args and args[-1] == '-stay_open' and line.lower() in ('false', '0'):
+            return 0
+        match = re.fullmatch(r'-execute(\d*)', line)
+        if match is None:
+            args.append(line)
+            continue
+        try:
+            run_command(args + common_args, sys.stdout, sys.stderr)
+        except Exception as e:
+            # Never leave the caller waiting for the {ready} marker
+            sys.stderr.write(f"Error: {e!r}\n")
+            for i, arg in enumerate(args[:-1]):
+                if arg == '-echo4':
+                    sys.stderr.write(args[i + 1].replace('${status}', '1') + '\n')
+        sys.stdout.write('{ready' + match.group(1) + '}\n')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        args = []
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,217 @@
+"""
+Content fingerprints of the videos, to recognise the same clip copied from a card more than once.
+
+A fingerprint is the file size plus a BLAKE2 hash of the first and last few megabytes of the file, which is
+enough to tell trail camera clips apart without reading them whole. Fingerprints are kept in an SQLite index
+shared by every folder, keyed by path, size and modification time so an unchanged file is never hashed twice.
+The same index stores the results computed for a fingerprint (motion verdicts, dates written), so the scan
+and redate pipelines can reuse them for every other copy of the clip and list the duplicate groups.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+
+# Index shared by all the folders, can be overridden with the TRAILCAM_FINGERPRINTS environment variable
+INDEX_PATH = os.environ.get('TRAILCAM_FINGERPRINTS',
+                            os.path.join(os.path.expanduser('~'), '.trailcam_fingerprints.sqlite'))
+
+# Number of bytes hashed at each end of a file
+EDGE_SIZE = 4 * 2 ** 20
+
+# Name of the report listing the duplicate groups
+DUPLICATES_REPORT = 'duplicates.csv'
+
+def compute_fingerprint(filepath, edge_size=EDGE_SIZE):
+    """
+    Compute the fingerprint of a file from its size and the bytes at both of its ends.
+
+    Files up to twice edge_size are hashed whole. Each end is read with a single unbuffered read.
+
+    :param filepath: Path to the file.
+    :param edge_size: Number of bytes hashed at each end.
+    :return: The fingerprint, as a "size-hash" string.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb', buffering=0) as file:
+        size = os.fstat(file.fileno()).st_size
+        whole = size <= 2 * edge_size
+        view = memoryview(bytearray(size if whole else edge_size))
+        offsets = [0] if whole else [0, size - edge_size]
+        for offset in offsets:
+            file.seek(offset)
+            read = 0
+            while read < len(view):
+                count = file.readinto(view[read:])
+                if not count:
+                    break
+                read += count
+            digest.update(view[:read])
+    return f'{size}-{digest.hexdigest()}'
+
+def open_index(index_path=None):
+    """
+    Open (and create if needed) the fingerprint index.
+
+    :param index_path: Path to the index database. Defaults to INDEX_PATH.
+    :return: An sqlite3 connection to the index.
+    """
+    conn = sqlite3.connect(index_path or INDEX_PATH)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            fingerprint TEXT NOT NULL
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS files_fingerprint ON files (fingerprint)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS results (
+            fingerprint TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            path TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (fingerprint, kind, key)
+        )''')
+    conn.commit()
+    return conn
+
+def get_fingerprint(conn, filepath):
+    """
+    Retrieve the fingerprint of a file, computing and storing it if the file is new or changed.
+
+    :param conn: The index connection.
+    :param filepath: Path to the file.
+    :return: The fingerprint.
+    """
+    path = os.path.abspath(filepath)
+    stat = os.stat(path)
+    row = conn.execute('SELECT size, mtime_ns, fingerprint FROM files WHERE path = ?', (path,)).fetchone()
+    if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+        return row[2]
+    fingerprint = compute_fingerprint(path)
+    conn.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, fingerprint) VALUES (?, ?, ?, ?)',
+                 (path, stat.st_size, stat.st_mtime_ns, fingerprint))
+    conn.commit()
+    return fingerprint
+
+def get_result(conn, fingerprint, kind, key):
+    """
+    Retrieve a result stored for a fingerprint.
+
+    :param conn: The index connection.
+    :param fingerprint: The fingerprint of the file.
+    :param kind: The kind of result, such as 'scan' or 'dates'.
+    :param key: The parameters the result depends on, such as the detector parameters key.
+    :return: A (path of the file it was computed on, value) tuple, or None if there is no such result.
+    """
+    row = conn.execute('SELECT path, value FROM results WHERE fingerprint = ? AND kind = ? AND key = ?',
+                       (fingerprint, kind, key)).fetchone()
+    return None if row is None else (row[0], json.loads(row[1]))
+
+def store_result(conn, fingerprint, kind, key, filepath, value):
+    """
+    Store a result computed on a file for its fingerprint. The change is committed right away.
+
+    :param conn: The index connection.
+    :param fingerprint: The fingerprint of the file.
+    :param kind: The kind of result.
+    :param key: The parameters the result depends on.
+    :param filepath: Path to the file the result was computed on.
+    :param value: The result, any JSON serializable value.
+    """
+    conn.execute('INSERT OR REPLACE INTO results (fingerprint, kind, key, path, value) VALUES (?, ?, ?, ?, ?)',
+                 (fingerprint, kind, key, os.path.abspath(filepath), json.dumps(value)))
+    conn.commit()
+
+def duplicate_groups(conn, filepaths=None):
+    """
+    List the groups of indexed files sharing a fingerprint. Files that no longer exist are left out.
+
+    A file is grouped with the fingerprint it had when it was last hashed, so a copy that was redated since
+    still appears with the other copies of the card.
+
+    :param conn: The index connection.
+    :param filepaths: Only list the groups holding one of these files. Defaults to all the groups.
+    :return: A list of (fingerprint, sorted paths) tuples, sorted by first path.
+    """
+    rows = conn.execute('''
+        SELECT fingerprint, path FROM files
+        WHERE fingerprint IN (SELECT fingerprint FROM files GROUP BY fingerprint HAVING COUNT(*) > 1)''').fetchall()
+    groups = {}
+    for fingerprint, path in rows:
+        if os.path.exists(path):
+            groups.setdefault(fingerprint, []).append(path)
+    if filepaths is not None:
+        wanted = {os.path.abspath(filepath) for filepath in filepaths}
+        groups = {fingerprint: paths for fingerprint, paths in groups.items() if wanted.intersection(paths)}
+    return sorted(((fingerprint, sorted(paths)) for fingerprint, paths in groups.items() if len(paths) > 1),
+                  key=lambda group: group[1][0])
+
+def write_duplicates_report(conn, filepaths=None, report_file=DUPLICATES_REPORT):
+    """
+    Write the duplicate groups to a CSV file, one row per file, and print how many there are.
+
+    Nothing is written when there is no duplicate.
+
+    :param conn: The index connection.
+    :param filepaths: Only report the groups holding one of these files. Defaults to all the groups.
+    :param report_file: Path to the CSV file to write.
+    :return: The list of groups, see duplicate_groups().
+    """
+    groups = duplicate_groups(conn, filepaths)
+    if not groups:
+        return groups
+    with open(report_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Group", "Fingerprint", "Path"])
+        for number, (fingerprint, paths) in enumerate(groups, 1):
+            for path in paths:
+                writer.writerow([number, fingerprint, path])
+    copies = sum(len(paths) - 1 for _, paths in groups)
+    print(f"{copies} duplicate files in {len(groups)} groups, see {report_file}")
+    return groups
+
+def index_folders(conn, folders, extensions=('.mp4', '.mov', '.avi')):
+    """
+    Fingerprint the videos of folders and their subfolders. Hidden folders are skipped.
+
+    :param conn: The index connection.
+    :param folders: The folders to walk.
+    :param extensions: Extensions of the files to fingerprint, compared without case.
+    :return: The list of paths fingerprinted.
+    """
+    filepaths = []
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(folder):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.lower().endswith(extensions):
+                    filepath = os.path.join(dirpath, filename)
+                    get_fingerprint(conn, filepath)
+                    filepaths.append(filepath)
+    return filepaths
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint card dumps and report the clips copied more than once")
+    parser.add_argument('folders', nargs='+', help="Folders to fingerprint, subfolders included")
+    parser.add_argument('--index', help=f"Fingerprint index (default: {INDEX_PATH})")
+    parser.add_argument('--report', default=DUPLICATES_REPORT,
+                        help=f"CSV file listing the duplicate groups (default: {DUPLICATES_REPORT})")
+    args = parser.parse_args()
+
+    conn = open_index(args.index)
+    try:
+        filepaths = index_folders(conn, args.folders)
+        print(f"{len(filepaths)} videos fingerprinted")
+        if not write_duplicates_report(conn, filepaths, args.report):
+            print("No duplicates found")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,8 @@ Returns:
 import exiftool
 import os
 from datetime import datetime
-import re
+
+import original_index
 
 def get_video_dates(filename):
     """
@@ -44,25 +45,17 @@ def set_video_dates(filename, dates):
     modify_time = datetime.strptime(dates['modify_date'], date_format).timestamp()
     os.utime(filename, (modify_time, create_time))
 
-def match_and_update_dates(original_folder, converted_folder):
+def match_and_update_dates(original_folder, converted_folder, report_file='match_report.csv'):
     """
     Match converted videos with their original counterparts by handling the replacement of underscores with spaces.
-    """
-    for converted_filename in os.listdir(converted_folder):
-        if converted_filename.lower().endswith(('.mp4', '.mov', '.avi')):
-            # Replace spaces with underscores and remove the "-x" suffix
-            base_name = re.sub(r'-\d+', '', converted_filename).replace(' ', '_').upper()
-            original_filename = base_name
 
-            original_path = os.path.join(original_folder, original_filename)
-
-            if os.path.exists(original_path):
-                converted_path = os.path.join(converted_folder, converted_filename)
-                dates = get_video_dates(original_path)
-                set_video_dates(converted_path, dates)
-                print(f"Updated dates for {converted_filename}")
-            else:
-                print(f"Original file {original_filename} not found for {converted_filename}")
+    The original folder is indexed once, subfolders included, and the converted files are matched in memory.
+    Converted files without original or with several candidates are listed in report_file.
+    """
+    for original_path, converted_path in original_index.match_folder(original_folder, converted_folder, report_file):
+        dates = get_video_dates(original_path)
+        set_video_dates(converted_path, dates)
+        print(f"Updated dates for {os.path.basename(converted_path)}")
 
 
 def main():
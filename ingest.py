@@ -0,0 +1,333 @@
+"""
+Single-pass ingest of an SD card dump: rename, redate and scan every video for motion.
+
+The card is walked once and the header of each video is read once. The videos then flow through three
+concurrent stages linked by bounded queues:
+
+1. rename: PICTNNNN files are renamed after the content of the rename log (the _log.csv format of
+   rename_videos.py: content;first number[;last number]);
+2. redate: the capture date from the header (or from ExifTool when the header has none), shifted by an
+   optional offset for cameras with a wrong clock, is written to the renamed file in chunks;
+3. scan: the motion detector of mvmt_detector runs on the renamed and redated file.
+
+A single manifest is written at the end, with the old and new paths first so that revert_names.py can
+undo the renaming from it.
+"""
+
+import argparse
+import contextlib
+import csv
+import os
+import queue
+import re
+import threading
+from datetime import datetime, timedelta
+
+import avi_header
+import mp4_dates
+import mvmt_detector
+import redate_videos
+import scan_index
+
+# Extensions of the videos ingested
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mov')
+
+# Marks the end of the stream in the stage queues
+_DONE = object()
+
+def read_rename_log(log_path):
+    """
+    Read a rename log in the format of rename_videos.py.
+
+    :param log_path: Path to the log, one content;first number[;last number] row per sequence.
+    :return: A dictionary mapping each video number to its content.
+    """
+    contents = {}
+    with open(log_path, 'r') as file:
+        for row in csv.reader(file, delimiter=';'):
+            if not row or not row[0].strip():
+                continue
+            first = int(row[1])
+            last = int(row[2]) if len(row) > 2 and row[2].strip() else first
+            for number in range(first, last + 1):
+                contents[number] = row[0]
+    return contents
+
+def walk_videos(root, extensions=VIDEO_EXTENSIONS):
+    """
+    Yield the paths of the videos of a tree, folder by folder in name order. Hidden folders are skipped.
+
+    :param root: The root folder, such as the DCIM folder of the card.
+    :param extensions: Extensions of the files to yield, compared without case.
+    """
+    folders = [root]
+    while folders:
+        folder = folders.pop(0)
+        entries = sorted(os.scandir(folder), key=lambda entry: entry.name)
+        folders[:0] = [entry.path for entry in entries
+                       if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.')]
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(extensions):
+                yield entry.path
+
+def read_capture_info(filepath):
+    """
+    Read the capture date and frame count of a video from its header, without ExifTool.
+
+    The frame count of an AVI whose movi list holds chunks is never reported as 0, since clips the camera did
+    not finalize have a zero count in their header and still hold frames.
+
+    :param filepath: Path to the video.
+    :return: A (capture date or None, frame count or None) tuple.
+    """
+    try:
+        if filepath.lower().endswith('.avi'):
+            header = avi_header.read_avi_header(filepath)
+            if header['frame_count'] == 0 and header['has_frame_data']:
+                return header['capture_time'], None
+            return header['capture_time'], header['frame_count']
+        if filepath.lower().endswith(('.mp4', '.mov')):
+            dates = mp4_dates.read_quicktime_dates(filepath)
+            return (dates['create_date'] if dates is not None else None), None
+    except (ValueError, OSError):
+        pass
+    return None, None
+
+def plan_new_name(filepath, contents):
+    """
+    Build the new path of a video from the rename log contents, like rename_videos.py.
+
+    :param filepath: Path to the video.
+    :param contents: The contents returned by read_rename_log().
+    :return: The new path, or the same path if the video is not in the log.
+    """
+    folder, filename = os.path.split(filepath)
+    match = re.fullmatch(r'PICT(\d{4})(\.\w+)', filename, re.IGNORECASE)
+    if match is None or int(match.group(1)) not in contents:
+        return filepath
+    number = int(match.group(1))
+    return os.path.join(folder, "{}_{:04d}{}".format(contents[number], number, match.group(2)))
+
+def _rename_stage(inbox, outbox, contents):
+    """
+    Rename the videos and pass them on. A video is left under its old name if the new one is taken.
+    """
+    while True:
+        item = inbox.get()
+        if item is _DONE:
+            outbox.put(_DONE)
+            return
+        new_path = plan_new_name(item['old_path'], contents)
+        if new_path != item['old_path']:
+            if os.path.exists(new_path):
+                print(f"Not renaming {item['old_path']}: {new_path} already exists")
+                new_path = item['old_path']
+            else:
+                try:
+                    os.rename(item['old_path'], new_path)
+                except OSError as e:
+                    print(f"Not renaming {item['old_path']}: {e}")
+                    new_path = item['old_path']
+        item['new_path'] = new_path
+        outbox.put(item)
+
+def _redate_batch(batch, offset_days, skip_unchanged, overwrite_original):
+    """
+    Redate a batch of videos with one ExifTool read for the dates missing from the headers and one write plan.
+    """
+    missing = [item for item in batch if item['capture_date'] is None]
+    for item, tags in zip(missing, redate_videos.get_videos_tags([item['new_path'] for item in missing],
+                                                                ['File:FileModifyDate'])):
+        if tags.get('File:FileModifyDate'):
+            item['capture_date'] = datetime.strptime(tags['File:FileModifyDate'], '%Y:%m:%d %H:%M:%S%z')
+
+    plan = []
+    for item in batch:
+        if item['capture_date'] is None:
+            item['redate'] = 'no date'
+            continue
+        item['new_date'] = item['capture_date'] + timedelta(days=offset_days)
+        plan.append(redate_videos.plan_video_dates_change(item['new_path'], item['new_date']))
+
+    results = redate_videos.execute_write_plan(plan, skip_unchanged=skip_unchanged,
+                                               overwrite_original=overwrite_original)
+    items = {item['new_path']: item for item in batch}
+    for filename, success, message in results:
+        items[filename]['redate'] = message if success else 'Error: ' + message
+
+def _redate_stage(inbox, outbox, offset_days, batch_size, skip_unchanged, overwrite_original):
+    """
+    Redate the videos in batches of up to batch_size, without waiting for a full batch when the queue is empty.
+    """
+    done = False
+    try:
+        with contextlib.ExitStack() as stack:
+            try:
+                stack.enter_context(redate_videos.exiftool_session())
+                has_exiftool = True
+            except Exception as e:
+                print(f"Cannot start exiftool, the videos are not redated: {e!r}")
+                has_exiftool = False
+            while not done:
+                batch = [inbox.get()]
+                while len(batch) < batch_size and batch[-1] is not _DONE:
+                    try:
+                        batch.append(inbox.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is _DONE:
+                    batch.pop()
+                    done = True
+                if batch and not has_exiftool:
+                    for item in batch:
+                        item['redate'] = 'Error: no exiftool'
+                elif batch:
+                    try:
+                        _redate_batch(batch, offset_days, skip_unchanged, overwrite_original)
+                    except Exception as e:
+                        for item in batch:
+                            item.setdefault('redate', 'Error: ' + repr(e))
+                for item in batch:
+                    outbox.put(item)
+    finally:
+        outbox.put(_DONE)
+
+def _scan_stage(inbox, results, threshold, scan_options):
+    """
+    Scan the videos for motion until the end of the stream, which is passed on to the other scan threads.
+    """
+    while True:
+        item = inbox.get()
+        if item is _DONE:
+            inbox.put(_DONE)
+            return
+        if item['frame_count'] == 0:
+            item.update(motion=False, stage='header')
+        else:
+            try:
+                item['motion'] = mvmt_detector.movement_scan(item['new_path'], threshold, **scan_options)
+                item['stage'] = scan_options.get('backend', 'mog2')
+            except Exception as e:
+                print("Error with file " + item['new_path'] + ": " + repr(e))
+                item['motion'] = 'Error'
+        results[item['index']] = item
+
+def _store_in_index(items, threshold, scan_options):
+    """
+    Store the verdicts in the scan index of each folder, so a later scan_folder() with the same options skips them.
+    """
+    params = scan_index.detector_params(threshold=threshold, frame_stride=scan_options['frame_stride'],
+                                        scale=scan_options['scale'], segments=False, prefilter=False,
+                                        backend=scan_options['backend'], quick=False, roi=None)
+    by_folder = {}
+    for item in items:
+        if isinstance(item.get('motion'), bool):
+            by_folder.setdefault(os.path.dirname(item['new_path']), []).append(item)
+    for folder, folder_items in by_folder.items():
+        index = scan_index.open_index(folder)
+        try:
+            for item in folder_items:
+                scan_index.store_result(index, item['new_path'], params,
+                                        {'motion': item['motion'], 'stage': item['stage']})
+        finally:
+            index.close()
+
+def ingest(root, rename_log=None, offset_days=0.0, threshold=1000, frame_stride=1, scale=1.0, backend='mog2',
+           manifest_file='ingest_manifest.csv', scan_workers=2, queue_size=16, batch_size=50,
+           skip_unchanged=True, overwrite_original=False, use_index=True):
+    """
+    Rename, redate and scan all the videos of a card in a single pass.
+
+    :param root: The root folder of the card dump, searched recursively.
+    :param rename_log: Path to the rename log (see read_rename_log()). Without it the videos keep their names.
+    :param offset_days: Offset in days added to the capture dates, for cameras with a wrong clock.
+    :param threshold: The contour area threshold of the motion detector.
+    :param frame_stride: The frame stride passed to movement_scan.
+    :param scale: The scale passed to movement_scan.
+    :param backend: The background model passed to movement_scan.
+    :param manifest_file: Path to the manifest CSV file to write.
+    :param scan_workers: Number of threads scanning videos at the same time.
+    :param queue_size: Maximum number of videos waiting between two stages.
+    :param batch_size: Maximum number of videos redated with one ExifTool command.
+    :param skip_unchanged: Only touch the videos whose dates differ, see redate_videos.diff_write_plan().
+    :param overwrite_original: Do not keep the *_original backups.
+    :param use_index: Store the verdicts in the scan index of each folder.
+    :return: The list of ingested videos, each a dictionary with the old_path, new_path, capture_date,
+             new_date, redate result and motion verdict.
+    """
+    contents = read_rename_log(rename_log) if rename_log else {}
+    scan_options = {'frame_stride': frame_stride, 'scale': scale, 'backend': backend}
+
+    to_rename = queue.Queue(maxsize=queue_size)
+    to_redate = queue.Queue(maxsize=queue_size)
+    to_scan = queue.Queue(maxsize=queue_size)
+    results = {}
+    threads = [
+        threading.Thread(target=_rename_stage, args=(to_rename, to_redate, contents), daemon=True),
+        threading.Thread(target=_redate_stage, args=(to_redate, to_scan, offset_days, batch_size,
+                                                     skip_unchanged, overwrite_original), daemon=True),
+    ]
+    threads += [threading.Thread(target=_scan_stage, args=(to_scan, results, threshold, scan_options), daemon=True)
+                for _ in range(max(1, scan_workers))]
+    for thread in threads:
+        thread.start()
+
+    count = 0
+    try:
+        for filepath in walk_videos(root):
+            capture_date, frame_count = read_capture_info(filepath)
+            to_rename.put({'index': count, 'old_path': filepath, 'capture_date': capture_date,
+                           'frame_count': frame_count, 'new_date': None})
+            count += 1
+    finally:
+        to_rename.put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    items = [results[i] for i in range(count) if i in results]
+    if use_index:
+        _store_in_index(items, threshold, scan_options)
+    write_manifest(items, manifest_file)
+    return items
+
+def write_manifest(items, manifest_file):
+    """
+    Write the ingest manifest. The first two columns are the old and new paths, as read by revert_names.py.
+
+    :param items: The videos returned by ingest().
+    :param manifest_file: Path to the CSV file to write.
+    """
+    def date_str(date):
+        return date.strftime('%Y:%m:%d %H:%M:%S%z') if date is not None else ''
+
+    with open(manifest_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Old Name", "New Name", "Capture Date", "New Date", "Redate", "Movement Detected"])
+        for item in items:
+            writer.writerow([item['old_path'], item['new_path'], date_str(item['capture_date']),
+                             date_str(item['new_date']), item.get('redate', ''), item.get('motion', '')])
+
+def main():
+    parser = argparse.ArgumentParser(description="Rename, redate and scan the videos of an SD card dump in one pass")
+    parser.add_argument('folder', help="Root folder of the card dump")
+    parser.add_argument('--rename-log', metavar='PATH', help="Rename log in the rename_videos.py format (_log.csv)")
+    parser.add_argument('--offset-days', type=float, default=0.0,
+                        help="Days added to the capture dates, for cameras with a wrong clock (default: 0)")
+    parser.add_argument('--threshold', type=float, default=1000, help="Contour area threshold (default: 1000)")
+    parser.add_argument('--stride', type=int, default=1, help="Analyse only every Nth frame (default: 1)")
+    parser.add_argument('--scale', type=float, default=1.0, help="Resize factor applied to frames (default: 1.0)")
+    parser.add_argument('--backend', choices=mvmt_detector.BACKENDS, default='mog2',
+                        help="Background model used to detect motion (default: mog2)")
+    parser.add_argument('--scan-workers', type=int, default=2, help="Videos scanned at the same time (default: 2)")
+    parser.add_argument('--manifest', default='ingest_manifest.csv', help="Manifest file to write")
+    parser.add_argument('--overwrite-original', action='store_true',
+                        help="Do not keep the *_original backups written by ExifTool")
+    args = parser.parse_args()
+
+    items = ingest(args.folder, args.rename_log, args.offset_days, args.threshold, args.stride, args.scale,
+                   args.backend, args.manifest, args.scan_workers, overwrite_original=args.overwrite_original)
+    motion_count = sum(1 for item in items if item.get('motion') is True)
+    print(f"{len(items)} videos ingested, {motion_count} with motion, manifest written to {args.manifest}")
+
+if __name__ == "__main__":
+    main()
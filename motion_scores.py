@@ -0,0 +1,147 @@
+"""
+Per-frame motion scores, stored so that clips can be classified again with another threshold
+without decoding them.
+
+The scores of each clip are saved as a .npy array in a .mvmt_scores folder next to the clips,
+one subfolder per set of detector parameters they depend on (frame stride, scale, backend and
+regions of interest), and are loaded memory-mapped.
+"""
+
+import csv
+import hashlib
+import os
+
+import numpy as np
+
+import scan_index
+
+# Folder created next to the clips to hold their scores
+SCORES_FOLDER = '.mvmt_scores'
+
+# One record per analysed frame
+SCORES_DTYPE = np.dtype([
+    ('frame', '<i4'),       # Index of the frame in the clip
+    ('max_area', '<f4'),    # Largest contour area below half the frame, in native resolution pixels
+    ('fg_ratio', '<f4'),    # Fraction of the frame marked as foreground by the background subtractor
+])
+
+def scores_params(frame_stride=1, scale=1.0, backend='mog2', roi=None):
+    """
+    Build the key of the detector parameters the scores depend on.
+
+    The threshold is left out, the scores being meant to be classified again with other thresholds.
+
+    :param frame_stride: The frame stride used to compute the scores.
+    :param scale: The scale used to compute the scores.
+    :param backend: The background model used to compute the scores.
+    :param roi: The key of the regions of interest (see roi.config_key), or None without regions.
+    :return: A string, see scan_index.detector_params.
+    """
+    return scan_index.detector_params(frame_stride=frame_stride, scale=scale, backend=backend, roi=roi)
+
+def scores_folder(folder_path, params):
+    """
+    Build the path of the folder holding the scores computed with a set of detector parameters.
+
+    :param folder_path: Path to the folder containing the clips.
+    :param params: The key built by scores_params().
+    :return: The path of the scores folder.
+    """
+    key = hashlib.sha1(params.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(folder_path, SCORES_FOLDER, key)
+
+def scores_path(filepath, params):
+    """
+    Build the path of the scores file of a clip.
+
+    :param filepath: Path to the clip.
+    :param params: The key built by scores_params().
+    :return: The path of the .npy scores file.
+    """
+    folder_path, filename = os.path.split(filepath)
+    return os.path.join(scores_folder(folder_path, params), filename + '.npy')
+
+def save_scores(path, records):
+    """
+    Save the per-frame scores of a clip.
+
+    :param path: Path of the scores file.
+    :param records: A list of (frame, max_area, fg_ratio) tuples.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so an interrupted scan never leaves a truncated array
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        np.save(file, np.array(records, dtype=SCORES_DTYPE))
+    os.replace(tmp_path, path)
+
+def load_scores(path):
+    """
+    Load the per-frame scores of a clip, memory-mapped.
+
+    :param path: Path of the scores file.
+    :return: A structured array with the frame, max_area and fg_ratio fields.
+    """
+    return np.load(path, mmap_mode='r')
+
+def classify(scores, threshold):
+    """
+    Tell if a clip has motion from its scores, with the same rule as movement_scan.
+
+    :param scores: The scores of the clip.
+    :param threshold: The contour area threshold, in native resolution pixels.
+    :return: True if motion is detected.
+    """
+    return bool(len(scores) and (scores['max_area'] > threshold).any())
+
+def find_segments(scores, threshold, fps, max_gap=1.0):
+    """
+    Group the frames over the threshold into motion segments.
+
+    :param scores: The scores of the clip.
+    :param threshold: The contour area threshold, in native resolution pixels.
+    :param fps: The frame rate of the clip, used to convert frames to milliseconds.
+    :param max_gap: Frames over the threshold less than max_gap seconds apart belong to the same segment.
+    :return: A list of segments, each a dictionary with the start_frame, end_frame, start_ms, end_ms and peak_area.
+    """
+    above = scores['max_area'] > threshold
+    if not above.any():
+        return []
+    frames = scores['frame'][above]
+    areas = scores['max_area'][above]
+    breaks = np.flatnonzero(np.diff(frames) > max_gap * fps) + 1
+
+    segments = []
+    for segment_frames, segment_areas in zip(np.split(frames, breaks), np.split(areas, breaks)):
+        start_frame, end_frame = int(segment_frames[0]), int(segment_frames[-1])
+        segments.append({
+            'start_frame': start_frame,
+            'end_frame': end_frame,
+            'start_ms': round(start_frame * 1000.0 / fps),
+            'end_ms': round(end_frame * 1000.0 / fps),
+            'peak_area': float(segment_areas.max())
+        })
+    return segments
+
+def reclassify_folder(folder_path, threshold, params, results_file='results.csv'):
+    """
+    Classify all the scored clips of a folder with a new threshold and write the results to a CSV file.
+
+    :param folder_path: Path to the folder containing the clips.
+    :param threshold: The new contour area threshold, in native resolution pixels.
+    :param params: The key built by scores_params() with the parameters the scores were computed with.
+    :param results_file: Path to the CSV file to write.
+    :return: The number of clips with motion.
+    """
+    folder = scores_folder(folder_path, params)
+    filenames = sorted(name[:-len('.npy')] for name in os.listdir(folder) if name.endswith('.npy'))
+
+    motion_count = 0
+    with open(results_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Filename", "Movement Detected"])
+        for filename in filenames:
+            movement_detected = classify(load_scores(os.path.join(folder, filename + '.npy')), threshold)
+            motion_count += movement_detected
+            writer.writerow([os.path.join(folder_path, filename), movement_detected])
+    return motion_count
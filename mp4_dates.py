@@ -0,0 +1,163 @@
+"""
+Read and patch the QuickTime creation/modification dates of MP4/MOV files in place.
+
+The dates live in fixed-width fields of the mvhd, tkhd and mdhd atoms, so they can be changed
+through an mmap of the file without rewriting it. Files that cannot be handled here (other
+containers, fragmented or damaged files) are reported as such so the caller can fall back to ExifTool.
+"""
+
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta
+
+# QuickTime dates are stored as seconds since midnight, January 1, 1904
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
+
+# Atoms that contain the atoms holding the dates
+_CONTAINER_ATOMS = (b'moov', b'trak', b'mdia')
+
+# Atoms holding a creation and a modification date right after their version/flags
+DATE_ATOMS = (b'mvhd', b'tkhd', b'mdhd')
+
+def _iter_atoms(mm, start, end):
+    """
+    Iterate over the atoms found between start and end.
+
+    :param mm: The mmap of the file.
+    :param start: Offset of the first atom.
+    :param end: Offset where the parent atom (or the file) ends.
+    :return: A generator of (type, body offset, end offset) tuples.
+    :raises ValueError: If an atom header is invalid.
+    """
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', mm, offset)
+        header_size = 8
+        if size == 1:
+            # 64-bit size stored after the type
+            if offset + 16 > end:
+                raise ValueError(f"Truncated atom header at offset {offset}")
+            size = struct.unpack_from('>Q', mm, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            # Atom extends to the end of the file
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise ValueError(f"Invalid atom size at offset {offset}")
+        yield kind, offset + header_size, offset + size
+        offset += size
+
+def _find_date_atoms(mm):
+    """
+    Find the mvhd, tkhd and mdhd atoms of a file.
+
+    :param mm: The mmap of the file.
+    :return: A list of (type, body offset, end offset) tuples.
+    :raises ValueError: If the atom tree is invalid.
+    """
+    found = []
+
+    def walk(start, end):
+        for kind, body, atom_end in _iter_atoms(mm, start, end):
+            if kind in _CONTAINER_ATOMS:
+                walk(body, atom_end)
+            elif kind in DATE_ATOMS:
+                found.append((kind, body, atom_end))
+
+    walk(0, len(mm))
+    return found
+
+def _date_fields(mm, body, atom_end):
+    """
+    Return the struct format and offsets of the creation and modification dates of a date atom.
+
+    :return: A (format, creation offset, modification offset) tuple.
+    :raises ValueError: If the atom version is unknown or the atom is too short.
+    """
+    version = mm[body]
+    if version == 0:
+        fmt, create_offset, modify_offset = '>I', body + 4, body + 8
+    elif version == 1:
+        fmt, create_offset, modify_offset = '>Q', body + 4, body + 12
+    else:
+        raise ValueError(f"Unknown atom version {version}")
+    if modify_offset + struct.calcsize(fmt) > atom_end:
+        raise ValueError("Date atom is too short")
+    return fmt, create_offset, modify_offset
+
+def _to_quicktime(date):
+    """
+    Convert a datetime to QuickTime seconds.
+
+    The wall-clock time is stored as is, like ExifTool does without the QuickTimeUTC option.
+    """
+    return int((date.replace(tzinfo=None) - QUICKTIME_EPOCH).total_seconds())
+
+def _from_quicktime(seconds):
+    """
+    Convert QuickTime seconds to a naive datetime, or None if the date is not set.
+    """
+    if seconds == 0:
+        return None
+    return QUICKTIME_EPOCH + timedelta(seconds=seconds)
+
+def read_quicktime_dates(filename):
+    """
+    Read the movie creation and modification dates (mvhd atom) of an MP4/MOV file.
+
+    :param filename: Path to the video file.
+    :return: A dictionary with the creation and modification dates, or None if the file is not handled.
+    """
+    if os.path.getsize(filename) == 0:
+        return None
+    with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        try:
+            for kind, body, atom_end in _find_date_atoms(mm):
+                if kind == b'mvhd':
+                    fmt, create_offset, modify_offset = _date_fields(mm, body, atom_end)
+                    return {
+                        'create_date': _from_quicktime(struct.unpack_from(fmt, mm, create_offset)[0]),
+                        'modify_date': _from_quicktime(struct.unpack_from(fmt, mm, modify_offset)[0])
+                    }
+        except ValueError:
+            return None
+    return None
+
+def write_quicktime_dates(filename, create_date, modify_date, atoms=DATE_ATOMS):
+    """
+    Patch the creation and modification dates of the given atoms in place.
+
+    The mvhd, tkhd and mdhd atoms hold ExifTool's QuickTime CreateDate/ModifyDate,
+    TrackCreateDate/TrackModifyDate and MediaCreateDate/MediaModifyDate tags.
+    Nothing is written unless every matching atom can be patched.
+
+    :param filename: Path to the video file.
+    :param create_date: The new creation date.
+    :param modify_date: The new modification date.
+    :param atoms: The types of the atoms to patch.
+    :return: True if the file was patched, False if it is not handled and ExifTool should be used instead.
+    """
+    create_seconds = _to_quicktime(create_date)
+    modify_seconds = _to_quicktime(modify_date)
+    if os.path.getsize(filename) == 0 or min(create_seconds, modify_seconds) < 0:
+        return False
+
+    with open(filename, 'r+b') as file, mmap.mmap(file.fileno(), 0) as mm:
+        try:
+            found = _find_date_atoms(mm)
+            if not any(kind == b'mvhd' for kind, _, _ in found):
+                return False
+            fields = [_date_fields(mm, body, atom_end) for kind, body, atom_end in found if kind in atoms]
+        except ValueError:
+            return False
+
+        # Version 0 atoms only have 32 bits for the dates
+        if any(fmt == '>I' and max(create_seconds, modify_seconds) > 0xFFFFFFFF for fmt, _, _ in fields):
+            return False
+
+        for fmt, create_offset, modify_offset in fields:
+            struct.pack_into(fmt, mm, create_offset, create_seconds)
+            struct.pack_into(fmt, mm, modify_offset, modify_seconds)
+        mm.flush()
+    return True
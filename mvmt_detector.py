@@ -2,130 +2,882 @@ import cv2
 import csv
 import os
 import numpy as np
+import argparse
+import collections
+import json
+import math
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-# Scan a video for motion and return True if motion is detected
-def movement_scan(filename, threshold, display_output=False):
-    print("Scanning file: " + filename)
-    cap = cv2.VideoCapture(filename)
-    mog = cv2.createBackgroundSubtractorMOG2()
+import avi_header
+import fingerprints
+import motion_scores
+import roi as roi_config
+import scan_index
+import stage_timings
+import thumbnails as thumbnails_cache
+
+# Background models available to movement_scan
+BACKENDS = ('mog2', 'median')
+
+# Decoded bytes buffered ahead for each prefetched video, about 10 frames at 1080p
+PREFETCH_BYTES = 64 * 2 ** 20
 
+# Read the frames of a video, yielding (frame_index, frame) tuples
+# Only every frame_stride-th frame is decoded, the others are skipped with grab(),
+# and the kept frames are cropped to crop (x, y, width, height) then resized by scale.
+def _read_frames(cap, frame_stride=1, scale=1.0, crop=None):
+    frame_index = -1
     while cap.isOpened():
+        # Skip the frames between two analysed frames without decoding them
+        for _ in range(frame_stride - 1):
+            if not cap.grab():
+                return
+            frame_index += 1
+
         ret, frame = cap.read()
         if not ret:
-            break
-        
-        # Apply histogram equalization to increase contrast
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        frame = cv2.equalizeHist(frame)
-        
-        if display_output:
-            cv2.imshow('Motion Detection', frame)
-            cv2.waitKey(1)
-
-        frame_width = frame.shape[1]
-        frame_height = frame.shape[0]
-        frame_area = (frame_width * frame_height) / 2.0
-        
-        fgmask = mog.apply(frame)
-        contours, _ = cv2.findContours(fgmask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        
-        for contour in contours:
-            contour_area = cv2.contourArea(contour)
-            if contour_area < frame_area and contour_area > threshold:
-                if display_output:
-                    # Draw a bounding box around the moving object
-                    x, y, w, h = cv2.boundingRect(contour)
-                    frame = cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+            return
+        frame_index += 1
 
-                    # Show the frame with the moving object
-                    cv2.imshow('Motion Detection', frame)
+        if crop is not None:
+            x, y, width, height = crop
+            frame = frame[y:y + height, x:x + width]
+        if scale != 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        yield frame_index, frame
+
+# Same as _read_frames, but the frames are decoded by a separate thread into a
+# bounded queue so decoding overlaps with the analysis of the previous frames.
+# Closing the generator stops the decode thread, which is waited for so the
+# capture can be released safely. An error in the decode thread is passed
+# through the queue in place of the end marker and raised again here.
+def _read_frames_threaded(cap, frame_stride=1, scale=1.0, crop=None, queue_size=32):
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    end_of_video = object()
 
-                    # Wait for a key press and quit if 'q' is pressed
-                    if cv2.waitKey(1) &  0xFF == ord('q'):
+    def decode():
+        end = end_of_video
+        try:
+            for item in _read_frames(cap, frame_stride, scale, crop):
+                # Wait for room in the queue, giving up if the analysis was cancelled
+                while not stop.is_set():
+                    try:
+                        frames.put(item, timeout=0.1)
                         break
-                cap.release()
-                cv2.destroyAllWindows()
-                return True
-        
-    cap.release()
-    cv2.destroyAllWindows()
-    return False
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            end = e
+        finally:
+            frames.put(end)
+
+    thread = threading.Thread(target=decode, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is end_of_video:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock the decode thread if it is waiting to put the end marker
+        while thread.is_alive():
+            try:
+                frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+# Cheap first stage of the detection cascade
+# Sampled frames are reduced to tiny grayscale thumbnails and compared with NumPy.
+# Returns False when no thumbnail differs enough from the previous one for a blob
+# of the threshold area to be possible, True when the clip needs the full scan.
+# With a crop (x, y, width, height), only that part of the frames is compared.
+def frame_difference_check(filename, threshold, sample_stride=5, thumb_size=(64, 48), pixel_threshold=15,
+                           crop=None):
+    cap = cv2.VideoCapture(filename)
+    thumbs = []
+    native_area = 0
+    try:
+        for _, frame in _read_frames(cap, sample_stride, crop=crop):
+            native_area = frame.shape[0] * frame.shape[1]
+            thumb = cv2.resize(frame, thumb_size, interpolation=cv2.INTER_AREA)
+            thumbs.append(cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY))
+    finally:
+        cap.release()
+
+    if len(thumbs) < 2:
+        # Not enough frames to decide, leave it to the full detector
+        return True
+
+    stack = np.stack(thumbs).astype(np.int16)
+    changed = (np.abs(np.diff(stack, axis=0)) > pixel_threshold).sum(axis=(1, 2))
+    # Only a quarter of the threshold area (in thumbnail pixels) is required to stay on the safe side
+    min_changed = max(1.0, threshold * thumb_size[0] * thumb_size[1] / native_area / 4)
+    return bool((changed >= min_changed).any())
+
+# Quick triage of a clip for very large archives
+# The clip is sampled at evenly spaced positions (seeking with
+# CAP_PROP_POS_FRAMES) and only a short burst of frames is decoded at each one.
+# Frame differences inside the bursts, and between the first frames of
+# consecutive bursts, are measured on small grayscale frames. Returns 'motion'
+# when they show a blob well over the threshold, 'empty' when nothing
+# changes at all, and 'uncertain' otherwise (the clip then needs a full scan).
+# The number of positions grows with the clip length so that no event lasting
+# min_event_seconds fits between two bursts, up to max_positions. 'empty' is
+# only returned when that spacing could be reached, an animal crossing the
+# frame between two bursts would be missed otherwise.
+def quick_scan(filename, threshold, positions=8, burst=3, width=160, pixel_threshold=25, crop=None,
+               min_event_seconds=1.0, max_positions=64):
+    cap = cv2.VideoCapture(filename)
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if frame_count < positions * burst:
+            return 'uncertain'
+
+        min_event_frames = min_event_seconds * fps
+        if min_event_frames >= 1:
+            positions = max(positions, math.ceil((frame_count - burst) / min_event_frames) + 1)
+        positions = min(positions, max_positions, frame_count // burst)
+        # Frames left unsampled between two consecutive bursts
+        gap = (frame_count - burst) / (positions - 1) - burst
+        can_be_empty = min_event_frames >= 1 and gap < min_event_frames
+
+        bursts = []
+        for position in np.linspace(0, frame_count - burst, positions).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+            frames = []
+            for _ in range(burst):
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if crop is not None:
+                    x, y, crop_width, crop_height = crop
+                    frame = frame[y:y + crop_height, x:x + crop_width]
+                factor = width / frame.shape[1]
+                small = cv2.resize(frame, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+                frames.append(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+            if not frames:
+                return 'uncertain'
+            bursts.append(np.stack(frames).astype(np.int16))
+    finally:
+        cap.release()
+
+    # Threshold converted to pixels of the small frames
+    small_threshold = threshold * factor * factor
+    half_area = bursts[0].shape[1] * bursts[0].shape[2] / 2.0
+
+    def max_blob(diffs):
+        max_area = 0
+        for diff in diffs:
+            _, _, stats, _ = cv2.connectedComponentsWithStats((diff > pixel_threshold).astype(np.uint8))
+            areas = stats[1:, cv2.CC_STAT_AREA]
+            areas = areas[areas < half_area]
+            if len(areas):
+                max_area = max(max_area, areas.max())
+        return max_area
+
+    burst_area = max(max_blob(np.abs(np.diff(frames, axis=0))) for frames in bursts)
+    across_area = max_blob(np.abs(np.diff(np.stack([frames[0] for frames in bursts]), axis=0)))
+
+    # A blob that appears between two bursts (an animal walking in) counts as motion too
+    if max(burst_area, across_area) > 2 * small_threshold:
+        return 'motion'
+    if can_be_empty and max(burst_area, across_area) < small_threshold / 4:
+        return 'empty'
+    return 'uncertain'
+
+# Score a block of grayscale frames against its median background
+# background is used instead of the block median when the block is too short
+# to give a reliable median. Foreground outside mask (if any) is ignored.
+# Returns the background and the per-frame (max_area, fg_ratio) arrays, areas
+# being in pixels of the block frames.
+def _score_block(block, background=None, diff_threshold=25, mask=None):
+    stack = np.stack(block)
+    if background is None:
+        background = np.median(stack, axis=0).astype(np.int16)
+    masks = (np.abs(stack.astype(np.int16) - background) > diff_threshold).astype(np.uint8)
+    if mask is not None:
+        masks &= (mask > 0).astype(np.uint8)
+    fg_ratios = masks.mean(axis=(1, 2))
+    half_area = masks.shape[1] * masks.shape[2] / 2.0
+
+    max_areas = np.zeros(len(block), dtype=np.float32)
+    for i, frame_mask in enumerate(masks):
+        _, _, stats, _ = cv2.connectedComponentsWithStats(frame_mask, connectivity=8)
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        areas = areas[areas < half_area]
+        if len(areas):
+            max_areas[i] = areas.max()
+    return background, max_areas, fg_ratios
+
+# Pass the frames through while keeping the most recent ones in recent, so the
+# frame of a score can still be looked up after the scoring step
+def _remember_frames(frames, recent):
+    try:
+        for frame_index, frame in frames:
+            recent.append((frame_index, frame))
+            yield frame_index, frame
+    finally:
+        frames.close()
+
+# Vectorized alternative to MOG2: frames are grouped in blocks of block_size,
+# the background of each block is its per-pixel median and the foreground masks
+# of the whole block are computed at once. Blobs are measured with
+# connectedComponentsWithStats instead of looping over contours.
+# With a region of interest, the motion outside its polygon is ignored.
+# With a timings dictionary, the conversions and the scoring of each block are timed.
+# Yields (frame_index, max_area, fg_ratio) for every frame.
+def _median_block_scores(frames, block_size=32, roi=None, scale=1.0, timings=None):
+    cvt_color = stage_timings.timed_function(timings, 'cvtColor', cv2.cvtColor)
+    equalize_hist = stage_timings.timed_function(timings, 'equalizeHist', cv2.equalizeHist)
+    score_block = stage_timings.timed_function(timings, 'median.score', _score_block)
+    block = []
+    indexes = []
+    background = None
+    mask = None
+    for frame_index, frame in frames:
+        gray = cvt_color(frame, cv2.COLOR_BGR2GRAY)
+        if roi is not None and mask is None:
+            mask = roi_config.roi_mask(roi, gray.shape, scale)
+        block.append(equalize_hist(gray))
+        indexes.append(frame_index)
+        if len(block) == block_size:
+            background, max_areas, fg_ratios = score_block(block, mask=mask)
+            yield from zip(indexes, max_areas, fg_ratios)
+            block, indexes = [], []
+    if block:
+        # A short last block is compared with the background of the previous block
+        short = background is not None and len(block) < block_size // 2
+        _, max_areas, fg_ratios = score_block(block, background if short else None, mask=mask)
+        yield from zip(indexes, max_areas, fg_ratios)
+
+# Scan a video for motion and return True if motion is detected
+# Only every frame_stride-th frame is decoded, the others are skipped with grab().
+# Kept frames are resized by scale before processing and the area threshold is
+# scaled by scale^2 so thresholds tuned at native resolution keep working.
+# With a scores_file, the whole clip is analysed and the per-frame motion scores
+# are saved to it so the clip can later be classified again with another threshold.
+# With segments, the whole clip is analysed and the list of motion segments is
+# returned instead of a boolean (an empty list when there is no motion).
+# With threaded, frames are decoded by a separate thread while they are analysed.
+# backend selects the background model: 'mog2' (default) or 'median' for the
+# vectorized block median model, which ignores display_output.
+# With a region of interest (see roi.find_roi), frames are cropped to its bounding
+# box before any processing and motion outside its polygon is ignored.
+# With a thumbnail_file, the frame with the largest blob over the threshold is
+# saved to it as a small JPEG (the first frame over the threshold when the scan
+# stops at the first detection).
+# With a timings dictionary (see stage_timings.py), the time spent opening, decoding,
+# in each OpenCV call and writing to disk is added to it, the decode calls counting frames.
+def movement_scan(filename, threshold, display_output=False, frame_stride=1, scale=1.0, scores_file=None,
+                  segments=False, threaded=False, backend='mog2', roi=None, thumbnail_file=None, timings=None):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {', '.join(BACKENDS)}")
+    print("Scanning file: " + filename)
+    cap = stage_timings.timed_function(timings, 'open', cv2.VideoCapture)(filename)
+    mog = cv2.createBackgroundSubtractorMOG2()
+    # Without timings these are the OpenCV functions themselves
+    cvt_color = stage_timings.timed_function(timings, 'cvtColor', cv2.cvtColor)
+    equalize_hist = stage_timings.timed_function(timings, 'equalizeHist', cv2.equalizeHist)
+    apply_mog = stage_timings.timed_function(timings, 'mog.apply', mog.apply)
+    find_contours = stage_timings.timed_function(timings, 'findContours', cv2.findContours)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    native_threshold = threshold
+    threshold = threshold * scale * scale
+    full_scan = scores_file is not None or segments
+    scores = []
+    motion = False
+
+    crop = roi['crop'] if roi is not None else None
+    if threaded:
+        frames = _read_frames_threaded(cap, frame_stride, scale, crop)
+    else:
+        frames = _read_frames(cap, frame_stride, scale, crop)
+    # The decode stage includes the disk reads, the crop and the resize
+    frames = stage_timings.timed_iterator(timings, 'decode', frames)
+    mask = None
+
+    # The median backend scores a whole block at once, so the frames of the block are kept around
+    recent = collections.deque(maxlen=64) if thumbnail_file is not None else None
+    if recent is not None:
+        frames = _remember_frames(frames, recent)
+    peak_area, peak_frame = 0.0, None
+
+    def track_peak(frame_index, area):
+        nonlocal peak_area, peak_frame
+        if recent is not None and area > threshold and area > peak_area:
+            peak_area, peak_frame = area, dict(recent)[frame_index].copy()
+
+    def save_peak():
+        if peak_frame is not None:
+            with stage_timings.timed(timings, 'thumbnail'):
+                thumbnails_cache.save_thumbnail(thumbnail_file, peak_frame)
+
+    try:
+        if backend == 'median':
+            for frame_index, max_area, fg_ratio in _median_block_scores(frames, roi=roi, scale=scale,
+                                                                        timings=timings):
+                track_peak(frame_index, max_area)
+                if full_scan:
+                    scores.append((frame_index, max_area / (scale * scale), fg_ratio))
+                    motion = motion or max_area > threshold
+                elif max_area > threshold:
+                    save_peak()
+                    return True
+        else:
+            for frame_index, frame in frames:
+                # Apply histogram equalization to increase contrast
+                frame = cvt_color(frame, cv2.COLOR_BGR2GRAY)
+                frame = equalize_hist(frame)
+            
+                if display_output:
+                    cv2.imshow('Motion Detection', frame)
+                    cv2.waitKey(1)
+
+                frame_width = frame.shape[1]
+                frame_height = frame.shape[0]
+                frame_area = (frame_width * frame_height) / 2.0
+            
+                fgmask = apply_mog(frame)
+                if roi is not None:
+                    # Ignore the motion outside the polygon of the region of interest
+                    if mask is None:
+                        mask = roi_config.roi_mask(roi, fgmask.shape, scale)
+                    fgmask = cv2.bitwise_and(fgmask, mask)
+                contours, _ = find_contours(fgmask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+
+                if full_scan:
+                    max_area = max((area for area in map(cv2.contourArea, contours) if area < frame_area), default=0.0)
+                    scores.append((frame_index, max_area / (scale * scale), cv2.countNonZero(fgmask) / fgmask.size))
+                    track_peak(frame_index, max_area)
+                    motion = motion or max_area > threshold
+                    continue
+            
+                for contour in contours:
+                    contour_area = cv2.contourArea(contour)
+                    if contour_area < frame_area and contour_area > threshold:
+                        track_peak(frame_index, contour_area)
+                        save_peak()
+                        if display_output:
+                            # Draw a bounding box around the moving object
+                            x, y, w, h = cv2.boundingRect(contour)
+                            frame = cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+
+                            # Show the frame with the moving object
+                            cv2.imshow('Motion Detection', frame)
 
+                            # Wait for a key press and quit if 'q' is pressed
+                            if cv2.waitKey(1) &  0xFF == ord('q'):
+                                break
+                        return True
+    finally:
+        # Stops the decode thread (if any) before the capture is released
+        frames.close()
+        cap.release()
+        cv2.destroyAllWindows()
+
+    save_peak()
+    if scores_file is not None:
+        with stage_timings.timed(timings, 'scores'):
+            motion_scores.save_scores(scores_file, scores)
+    if segments:
+        return motion_scores.find_segments(np.array(scores, dtype=motion_scores.SCORES_DTYPE), native_threshold, fps)
+    return motion
+
+
+# Check the AVI header of a clip before decoding it
+# Returns False for clips without any frame, None when the clip has to be scanned
+# A zero frame count alone is not enough, clips the camera did not finalize still hold frames that decode
+def _prefilter_clip(filepath):
+    if not filepath.lower().endswith('.avi'):
+        return None
+    try:
+        header = avi_header.read_avi_header(filepath)
+    except (ValueError, OSError):
+        # Let OpenCV deal with files the header reader does not understand
+        return None
+    if header['frame_count'] == 0 and not header['has_frame_data']:
+        print("Skipping empty clip: " + filepath)
+        return False
+    return None
+
+
+# Scan a single clip and return a (result, error) tuple
+# The result is a dictionary with the motion verdict, the stage that decided it
+# and, in segments mode, the segments.
+# With quick, quick_scan() triages the clip first and only uncertain clips are fully scanned.
+# With prefilter, clips rejected by frame_difference_check() are not passed to the detector.
+# Exceptions are returned instead of raised so one bad clip does not stop the scan,
+# which also lets it run in a worker process.
+# With timed, the result also holds the per-stage timing record of the clip under 'timings'.
+def _scan_clip(filepath, threshold, scan_options, prefilter=False, quick=False, timed=False):
+    timings = {} if timed else None
+    start = time.perf_counter()
+    result, error = _run_clip_stages(filepath, threshold, scan_options, prefilter, quick, timings)
+    if timed and result is not None:
+        result['timings'] = stage_timings.clip_record(filepath, time.perf_counter() - start, timings)
+    return result, error
+
+def _run_clip_stages(filepath, threshold, scan_options, prefilter, quick, timings):
+    segments = scan_options.get('segments')
+    result = {}
+    try:
+        roi = scan_options.get('roi')
+        crop = roi['crop'] if roi is not None else None
+        if quick:
+            with stage_timings.timed(timings, 'quick'):
+                result['quick'] = quick_scan(filepath, threshold, crop=crop)
+            # Clips with motion still need the full scan to get their segments
+            if result['quick'] == 'empty' or (result['quick'] == 'motion' and not segments):
+                result.update(motion=result['quick'] == 'motion', stage='quick')
+                if segments:
+                    result['segments'] = []
+                return result, None
+        if prefilter:
+            with stage_timings.timed(timings, 'prefilter'):
+                changed = frame_difference_check(filepath, threshold, crop=crop)
+            if not changed:
+                result.update(motion=False, stage='diff')
+                if segments:
+                    result['segments'] = []
+                return result, None
+        value = movement_scan(filepath, threshold, timings=timings, **scan_options)
+    except Exception as e:
+        return None, e
+    result['stage'] = scan_options.get('backend', 'mog2')
+    if isinstance(value, list):
+        result.update(motion=bool(value), segments=value)
+    else:
+        result['motion'] = value
+    return result, None
+
+
+# Give a copy of a clip the thumbnail of the clip its result comes from.
+# earlier is the (source path, result) tuple of that clip. Returns False when
+# thumbnails are wanted but the source has none, so the copy has to be scanned.
+def _reuse_thumbnail(earlier, filepath, thumbnails, params):
+    source, result = earlier
+    if not thumbnails or not result['motion'] or result.get('stage') == 'quick':
+        return True
+    thumbnail_file = thumbnails_cache.thumbnail_path(filepath, params)
+    if os.path.exists(thumbnail_file):
+        return True
+    source_thumbnail = thumbnails_cache.thumbnail_path(source, params)
+    if not os.path.exists(source_thumbnail):
+        return False
+    os.makedirs(os.path.dirname(thumbnail_file), exist_ok=True)
+    shutil.copyfile(source_thumbnail, thumbnail_file)
+    return True
 
 # Scan a folder for motion in videos and write the results to a CSV file
-def scan_folder(folder_path, extensions='.mp4,.AVI', display_output=False, threshold=1000):
+# With workers > 1 the clips are spread across a process pool, each worker
+# opening its own VideoCapture and background subtractor. The results are
+# still written in folder order and display_output is ignored in that mode.
+# AVI clips whose header reports no frame are recorded without being decoded.
+# With use_index, verdicts are kept in an index inside the folder and clips
+# that did not change since a previous scan with the same parameters are skipped.
+# With save_scores, the per-frame scores of each clip are kept for reclassify_folder().
+# Clips without any frame get an empty scores file, and prefilter and quick are
+# disabled since the clips they decide would have no scores.
+# With segments, the motion segments of each clip are written in a Segments column.
+# With threaded, each clip is decoded by a separate thread while it is analysed.
+# With prefilter, clips without any change between sampled thumbnails are rejected
+# before MOG2, and a Stage column tells which stage (header, quick, diff or the backend) decided.
+# backend selects the background model used by movement_scan ('mog2' or 'median').
+# roi_file is a JSON file of per-camera regions of interest (see roi.py).
+# With quick, clips are first triaged by quick_scan() and only the uncertain ones
+# are fully scanned. A Quick column gives the triage class (empty, motion or uncertain).
+# With thumbnails, the peak motion frame of each clip with motion is saved in a
+# cache next to the clips, for thumbnails.build_contact_sheets().
+# With a timings_file, the time spent in each stage of each scanned clip is written
+# to it (JSON, or CSV if its name ends with .csv) and summarized at the end of the scan.
+# With dedup, clips are fingerprinted (see fingerprints.py) and a copy of a clip already
+# scanned with the same parameters, in this folder or in an earlier dump, reuses its
+# result instead of being decoded again. A Duplicate Of column names the clip the
+# result comes from and the duplicate groups are written to duplicates.csv.
+# Ignored with save_scores, which needs the scores of every file.
+def scan_folder(folder_path, extensions='.mp4,.AVI', display_output=False, threshold=1000, workers=1,
+                frame_stride=1, scale=1.0, use_index=True, save_scores=False, segments=False, threaded=False,
+                prefilter=False, backend='mog2', roi_file=None, quick=False, thumbnails=False, timings_file=None,
+                dedup=False):
     extensions = tuple(extensions.split(','))
+    filepaths = [os.path.join(folder_path, filename) for filename in sorted(os.listdir(folder_path))
+                 if filename.endswith(extensions)]
 
-    with open('results.csv', 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["Filename", "Movement Detected"])
-        for filename in os.listdir(folder_path):
-            if filename.endswith(extensions): 
-                filepath = os.path.join(folder_path, filename)
-                movement_detected = movement_scan(filepath, threshold, display_output) # example threshold
-                writer.writerow([filepath, movement_detected])
+    if save_scores and (prefilter or quick):
+        print("prefilter and quick are disabled when saving scores, which needs the scores of every clip")
+        prefilter = quick = False
+
+    cameras = roi_config.load_roi_config(roi_file) if roi_file else []
+    rois = {filepath: roi_config.find_roi(cameras, filepath) for filepath in filepaths}
+
+    params = scan_index.detector_params(threshold=threshold, frame_stride=frame_stride, scale=scale, segments=segments,
+                                        prefilter=prefilter, backend=backend, quick=quick,
+                                        roi=roi_config.config_key(cameras) if cameras else None)
+    index = scan_index.open_index(folder_path) if use_index else None
+
+    scores_params = motion_scores.scores_params(frame_stride, scale, backend,
+                                                roi_config.config_key(cameras) if cameras else None)
+    scores_files = {filepath: motion_scores.scores_path(filepath, scores_params) if save_scores else None
+                    for filepath in filepaths}
+    thumbnail_files = {filepath: thumbnails_cache.thumbnail_path(filepath, params) if thumbnails else None
+                       for filepath in filepaths}
+    scan_options = {'frame_stride': frame_stride, 'scale': scale, 'segments': segments, 'threaded': threaded,
+                    'backend': backend}
+
+    results = {}
+    for filepath in filepaths:
+        movement_detected = _prefilter_clip(filepath)
+        if movement_detected is not None:
+            results[filepath] = {'motion': movement_detected, 'stage': 'header'}
+            if segments:
+                results[filepath]['segments'] = []
+            if save_scores and not os.path.exists(scores_files[filepath]):
+                motion_scores.save_scores(scores_files[filepath], [])
+        elif index is not None and not (save_scores and not os.path.exists(scores_files[filepath])):
+            result = scan_index.get_result(index, filepath, params)
+            # Clips with motion scanned before thumbnails were requested are scanned again
+            if result is not None and not (thumbnails and result['motion'] and result.get('stage') != 'quick'
+                                           and not os.path.exists(thumbnail_files[filepath])):
+                results[filepath] = result
+    to_scan = [filepath for filepath in filepaths if filepath not in results]
+
+    fingerprint_index = fingerprints.open_index() if dedup and not save_scores else None
+    clip_fingerprints = {}
+    duplicates = {}
+    if fingerprint_index is not None:
+        first_copies = {}
+        for filepath in filepaths:
+            clip_fingerprints[filepath] = fingerprints.get_fingerprint(fingerprint_index, filepath)
+        for filepath in to_scan:
+            fingerprint = clip_fingerprints[filepath]
+            earlier = fingerprints.get_result(fingerprint_index, fingerprint, 'scan', params)
+            if earlier is not None and _reuse_thumbnail(earlier, filepath, thumbnails, params):
+                source, result = earlier
+                results[filepath] = result if source == os.path.abspath(filepath) else dict(result, duplicate_of=source)
+                if index is not None:
+                    scan_index.store_result(index, filepath, params, results[filepath])
+            elif fingerprint in first_copies:
+                # A second copy in this folder waits for the result of the first one, and is scanned if it fails
+                duplicates[filepath] = first_copies[fingerprint]
+            else:
+                first_copies[fingerprint] = filepath
+        to_scan = [filepath for filepath in to_scan if filepath not in results and filepath not in duplicates]
+    if index is not None or fingerprint_index is not None:
+        print(f"{len(to_scan)} of {len(filepaths)} files to scan")
+
+    timed = timings_file is not None
+    timing_records = []
+    start = time.perf_counter()
+
+    def record(filepath, result, error):
+        if error is not None:
+            print("Error with file " + filepath + ": " + repr(error))
+            results[filepath] = {'motion': 'Error'}
+            return
+        if timed:
+            timing_records.append(result.pop('timings'))
+        results[filepath] = result
+        if index is not None:
+            scan_index.store_result(index, filepath, params, result)
+        if fingerprint_index is not None:
+            fingerprints.store_result(fingerprint_index, clip_fingerprints[filepath], 'scan', params, filepath, result)
+
+    def clip_options(filepath):
+        return dict(scan_options, scores_file=scores_files[filepath], thumbnail_file=thumbnail_files[filepath],
+                    roi=rois[filepath])
 
-# Play videos with motion read from a CSV file
-# The CSV file should have two columns: filename and motion_detected
-# The user can press 'q' to quit or 'n' to skip to the next video
-# The last played video is saved to a text file
-def play_videos_with_motion(folder_path='', motion_file='motion_videos.csv', last_played_file='last_played.txt'):
     try:
-        with open(last_played_file, 'r') as file:
-            last_played = file.readline().strip()
-    except FileNotFoundError:
-        print ("No last played file found")
-        last_played = ''
+        if workers <= 1:
+            for filepath in to_scan:
+                record(filepath, *_scan_clip(filepath, threshold, dict(clip_options(filepath),
+                                                                       display_output=display_output),
+                                             prefilter, quick, timed))
+        else:
+            if display_output:
+                print("display_output is disabled when scanning with workers")
 
-    start_playing = (last_played == '')
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_scan_clip, filepath, threshold, clip_options(filepath),
+                                           prefilter, quick, timed): filepath
+                           for filepath in to_scan}
+                for future in as_completed(futures):
+                    filepath = futures[future]
+                    try:
+                        result, error = future.result()
+                    except Exception as e:
+                        # The worker process itself died (e.g. a crash inside the decoder)
+                        result, error = None, e
+                    record(filepath, result, error)
 
+        for filepath, source in duplicates.items():
+            result = results.get(source)
+            if result is not None and result['motion'] == 'Error':
+                # The copy may still decode (the worker of the first one may have crashed), and gets its own
+                # Error row otherwise
+                record(filepath, *_scan_clip(filepath, threshold, clip_options(filepath), prefilter, quick, timed))
+            elif result is not None:
+                result = dict(result, duplicate_of=os.path.abspath(source))
+                _reuse_thumbnail((source, result), filepath, thumbnails, params)
+                results[filepath] = result
+                if index is not None:
+                    scan_index.store_result(index, filepath, params, result)
+    finally:
+        if index is not None:
+            index.close()
+        if fingerprint_index is not None:
+            fingerprints.write_duplicates_report(fingerprint_index, filepaths)
+            fingerprint_index.close()
+        # Write what was scanned so far, in folder order, even if the scan was interrupted
+        with open('results.csv', 'w', newline='') as file:
+            writer = csv.writer(file)
+            show_stage = prefilter or quick
+            writer.writerow(["Filename", "Movement Detected"] + (["Segments"] if segments else [])
+                            + (["Stage"] if show_stage else []) + (["Quick"] if quick else [])
+                            + (["Duplicate Of"] if fingerprint_index is not None else []))
+            for filepath in filepaths:
+                if filepath in results:
+                    result = results[filepath]
+                    row = [filepath, result['motion']]
+                    if segments:
+                        row.append(json.dumps(result.get('segments', [])))
+                    if show_stage:
+                        row.append(result.get('stage', ''))
+                    if quick:
+                        row.append(result.get('quick', ''))
+                    if fingerprint_index is not None:
+                        row.append(result.get('duplicate_of', ''))
+                    writer.writerow(row)
+        if timed:
+            stage_timings.write_records(timings_file, timing_records)
+            stage_timings.print_summary(timing_records, time.perf_counter() - start)
+            print("Timings written to " + timings_file)
+
+# Read the (filename, motion_detected, segments) rows of a CSV results file or of a scan index
+# segments is None when the scan did not record them
+# Copies of clips scanned elsewhere (see scan_folder's dedup) are left out so they are not shown twice
+def _read_motion_rows(motion_file):
+    if motion_file.endswith(scan_index.INDEX_FILENAME):
+        return [(filepath, str(result['motion']), result.get('segments'))
+                for filepath, result in scan_index.read_results(motion_file) if not result.get('duplicate_of')]
     with open(motion_file, 'r') as file:
         reader = csv.reader(file)
-        next(reader)  # Skip the header
-        for row in reader:
-            filename, motion_detected = row
+        header = next(reader)
+        segments_column = header.index("Segments") if "Segments" in header else None
+        duplicate_column = header.index("Duplicate Of") if "Duplicate Of" in header else None
+        return [(row[0], row[1], json.loads(row[segments_column]) if segments_column is not None else None)
+                for row in reader if duplicate_column is None or not row[duplicate_column]]
+
+# Open a video and decode its first frames, up to prefetch_bytes of them, starting
+# at start_frame or start_ms, so playback can start without waiting for the card or
+# the network. The budget is in bytes so the memory held by the prefetched videos
+# does not grow with their resolution.
+# Returns the capture and the list of decoded (frame, frame_index, pos_ms) tuples.
+def _open_video(video_path, start_frame=None, start_ms=None, prefetch_bytes=PREFETCH_BYTES):
+    cap = cv2.VideoCapture(video_path)
+    if start_frame is not None:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    elif start_ms is not None:
+        cap.set(cv2.CAP_PROP_POS_MSEC, start_ms)
+    buffered = []
+    size = 0
+    for item in _decoded_frames(cap):
+        buffered.append(item)
+        size += item[0].nbytes
+        if size >= prefetch_bytes:
+            break
+    return cap, buffered
+
+# Yield the (frame, frame_index, pos_ms) tuples of a capture, after the buffered ones
+def _decoded_frames(cap, buffered=()):
+    yield from buffered
+    while cap.isOpened():
+        frame_index = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame, frame_index, cap.get(cv2.CAP_PROP_POS_MSEC)
 
-            if filename == last_played:
-                start_playing = True
-                continue
+# Play a video until end_ms (or its end when end_ms is None), starting with the buffered frames
+# Returns the key that stopped the playback ('q' or 'n', None otherwise) and the index of the last frame shown
+def _play_video(cap, filename, end_ms=None, buffered=()):
+    last_frame = None
+    for frame, frame_index, pos_ms in _decoded_frames(cap, buffered):
+        if end_ms is not None and pos_ms > end_ms:
+            break
+        last_frame = frame_index
 
-            if not start_playing:
-                continue
+        # Display filename in the upper right corner
+        cv2.putText(frame, filename, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2, cv2.LINE_AA)
+        cv2.imshow('Motion Video', frame)
 
-            if motion_detected.lower() == 'true':
-                video_path = os.path.join(folder_path, filename)
-                print("Playing video:", video_path)
-                cap = cv2.VideoCapture(video_path)
+        key = cv2.waitKey(1)
+        if key & 0xFF == ord('q'):
+            return 'q', last_frame
+        elif key & 0xFF == ord('n'):
+            # Skip to next video
+            return 'n', last_frame
+        elif key & 0xFF == ord('p'):
+            # Pause
+            cv2.waitKey(0)
+    return None, last_frame
 
-                while cap.isOpened():
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
+# Merge the motion segments of a video into the time ranges to play, with some
+# context before and after each segment
+def _segment_ranges(segments, margin_ms=1000):
+    ranges = []
+    for segment in segments:
+        start_ms = max(0, segment['start_ms'] - margin_ms)
+        end_ms = segment['end_ms'] + margin_ms
+        if ranges and start_ms <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end_ms)
+        else:
+            ranges.append([start_ms, end_ms])
+    return ranges
 
-                    # Display filename in the upper right corner
-                    cv2.putText(frame, filename, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2, cv2.LINE_AA)
-                    cv2.imshow('Motion Video', frame)
-
-                    key = cv2.waitKey(1)
-                    if key & 0xFF == ord('q'):
-                        with open(last_played_file, 'w') as file:
-                            file.write(filename)
-                        cap.release()
-                        cv2.destroyAllWindows()
-                        return
-                    elif key & 0xFF == ord('n'):
-                        # Skip to next video
-                        break
-                    elif key & 0xFF == ord('p'):
-                        # Pause
-                        cv2.waitKey(0)
+# Read the last played file: the filename and, on a second line, the frame to resume from
+# Files written before the frame was saved only have the filename
+def _read_last_played(last_played_file):
+    try:
+        with open(last_played_file, 'r') as file:
+            lines = file.read().splitlines()
+    except FileNotFoundError:
+        print ("No last played file found")
+        return '', None
+    last_played = lines[0].strip() if lines else ''
+    resume_frame = int(lines[1]) if len(lines) > 1 and lines[1].strip() else None
+    return last_played, resume_frame
+
+# Play videos with motion read from a CSV file or from the scan index of a folder
+# The CSV file should have two columns: filename and motion_detected
+# When the scan recorded motion segments, only those parts of the videos are played
+# The next prefetch videos are opened and their first frames decoded in a
+# background thread so there is no stall between videos
+# The user can press 'q' to quit or 'n' to skip to the next video
+# The last played video and frame are saved to a text file and playback resumes there
+def play_videos_with_motion(folder_path='', motion_file='motion_videos.csv', last_played_file='last_played.txt',
+                            prefetch=2):
+    last_played, resume_frame = _read_last_played(last_played_file)
 
-                cap.release()
+    playlist = [(filename, _segment_ranges(segments) if segments else [[None, None]])
+                for filename, motion_detected, segments in _read_motion_rows(motion_file)
+                if motion_detected.lower() == 'true']
+    positions = {filename: i for i, (filename, _) in enumerate(playlist)}
 
-    cv2.destroyAllWindows()
+    start = 0
+    if last_played in positions:
+        # Without a saved frame the last played video is skipped, like before frames were saved
+        start = positions[last_played] if resume_frame is not None else positions[last_played] + 1
+    else:
+        resume_frame = None
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        def schedule(i):
+            if i < len(playlist) and i not in pending:
+                filename, ranges = playlist[i]
+                start_frame = resume_frame if i == start else None
+                pending[i] = executor.submit(_open_video, os.path.join(folder_path, filename),
+                                             start_frame, ranges[0][0])
+
+        try:
+            for i in range(start, len(playlist)):
+                for j in range(i, i + prefetch + 1):
+                    schedule(j)
+                filename, ranges = playlist[i]
+                cap, buffered = pending.pop(i).result()
+                print("Playing video:", os.path.join(folder_path, filename))
+
+                if i == start and resume_frame is not None and buffered:
+                    # Drop the segments that were already watched
+                    current_ms = buffered[0][2]
+                    ranges = [[start_ms, end_ms] for start_ms, end_ms in ranges if end_ms is None or end_ms >= current_ms]
+
+                try:
+                    for k, (start_ms, end_ms) in enumerate(ranges):
+                        if k > 0 or (i == start and resume_frame is not None and start_ms is not None
+                                     and buffered and start_ms > buffered[0][2]):
+                            # Seek straight to the segment, skipping the footage without motion
+                            cap.set(cv2.CAP_PROP_POS_MSEC, start_ms)
+                            buffered = []
+                        key, last_frame = _play_video(cap, filename, end_ms, buffered)
+                        buffered = []
+                        if key == 'q':
+                            with open(last_played_file, 'w') as file:
+                                file.write(filename + '\n' + str(last_frame if last_frame is not None else 0))
+                            return
+                        elif key == 'n':
+                            break
+                finally:
+                    cap.release()
+        finally:
+            for future in pending.values():
+                future.result()[0].release()
+            cv2.destroyAllWindows()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scan trail camera videos for motion and play them back")
+    parser.add_argument('folder', nargs='?', default="D:\\temp\\DCIM\\100DSCIM",
+                        help="Folder containing the videos to scan")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes used to scan the folder (default: 1)")
+    parser.add_argument('--stride', type=int, default=1,
+                        help="Analyse only every Nth frame (default: 1)")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="Resize factor applied to frames before analysis, e.g. 0.25 (default: 1.0)")
+    parser.add_argument('--no-index', action='store_true',
+                        help="Rescan every clip instead of reusing the verdicts stored in the folder's scan index")
+    parser.add_argument('--scores', action='store_true',
+                        help="Analyse whole clips and save their per-frame motion scores for --reclassify (disables --prefilter and --quick)")
+    parser.add_argument('--segments', action='store_true',
+                        help="Record the motion segments of each clip so playback skips the footage without motion")
+    parser.add_argument('--threaded', action='store_true',
+                        help="Decode each clip in a separate thread while it is analysed (helps on slow card readers and network shares)")
+    parser.add_argument('--prefilter', action='store_true',
+                        help="Reject clips without any change between sampled thumbnails before the full MOG2 detector")
+    parser.add_argument('--backend', choices=BACKENDS, default='mog2',
+                        help="Background model used to detect motion (default: mog2)")
+    parser.add_argument('--roi-config', metavar='PATH',
+                        help="JSON file of per-camera regions of interest, see roi.py")
+    parser.add_argument('--quick', action='store_true',
+                        help="Triage clips from a few short bursts and fully scan only the uncertain ones")
+    parser.add_argument('--thumbnails', action='store_true',
+                        help="Save the peak motion frame of each clip with motion, see thumbnails.py for contact sheets")
+    parser.add_argument('--timings', nargs='?', const='scan_timings.json', metavar='PATH',
+                        help="Write the time spent in each stage of each clip to PATH (JSON, or CSV if it ends "
+                             "with .csv, default: scan_timings.json) and print a summary after the scan")
+    parser.add_argument('--dedup', action='store_true',
+                        help="Reuse the result of clips already scanned in another copy of the card and list the "
+                             "duplicates in duplicates.csv")
+    parser.add_argument('--reclassify', type=float, metavar='THRESHOLD',
+                        help="Write results.csv from the scores saved with the same --stride, --scale, --backend and "
+                             "--roi-config, with a new threshold and without decoding the videos")
+    return parser.parse_args()
 
 def main():
-    folder_name = "D:\\temp\\DCIM\\100DSCIM"
+    args = parse_args()
+    folder_name = args.folder
+
+    if args.reclassify is not None:
+        # The scores are looked up with the same stride, scale, backend and regions as the scan that saved them
+        cameras = roi_config.load_roi_config(args.roi_config) if args.roi_config else []
+        params = motion_scores.scores_params(args.stride, args.scale, args.backend,
+                                             roi_config.config_key(cameras) if cameras else None)
+        motion_count = motion_scores.reclassify_folder(folder_name, args.reclassify, params)
+        print(f"{motion_count} videos with motion at threshold {args.reclassify:g}")
+        return
 
     while True:
         print("\nMenu:")
@@ -136,7 +888,12 @@ def main():
         choice = input("Enter your choice (1/2/3): ").strip()
 
         if choice == '1':
-            scan_folder(folder_name, display_output=True)
+            scan_folder(folder_name, display_output=True, workers=args.workers,
+                        frame_stride=args.stride, scale=args.scale, use_index=not args.no_index,
+                        save_scores=args.scores, segments=args.segments, threaded=args.threaded,
+                        prefilter=args.prefilter, backend=args.backend, roi_file=args.roi_config,
+                        quick=args.quick, thumbnails=args.thumbnails, timings_file=args.timings,
+                        dedup=args.dedup)
         elif choice == '2':
             print ("Press 'q' to quit or 'n' to skip to the next video")
             print ("Press 'p' to pause the video")
@@ -0,0 +1,123 @@
+"""
+Index of the original videos of a tree, to match converted copies with their originals in memory.
+
+The original tree is walked once with os.scandir, subfolders included (100MEDIA, 101MEDIA, ...), and
+each video is keyed by its normalized name: the "-N" suffix added by HandBrake stripped, spaces and
+underscores folded together and case ignored. Converted files are then matched without touching the
+disk again, and the ones with no original or with several candidates are listed in a report.
+"""
+
+import csv
+import os
+import re
+
+# Extensions of the videos indexed and matched
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+def normalize_name(filename):
+    """
+    Build the key used to match a converted file with its original.
+
+    :param filename: Name of the file, with or without its folder.
+    :return: The name without extension, "-N" suffix, case and space/underscore differences.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    stem = re.sub(r'-\d+$', '', stem)
+    return re.sub(r'[ _]+', '_', stem).casefold()
+
+def build_original_index(root, extensions=VIDEO_EXTENSIONS, exclude=()):
+    """
+    Walk a tree once and index its videos by normalized name.
+
+    Hidden folders (such as the scan caches) are skipped.
+
+    :param root: Root folder of the originals.
+    :param extensions: Extensions of the files to index, compared without case.
+    :param exclude: Folders not to index, such as the converted folder when it is inside the tree.
+    :return: A dictionary mapping each normalized name to the list of paths having it.
+    """
+    excluded = {os.path.normcase(os.path.abspath(folder)) for folder in exclude}
+    index = {}
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError as e:
+            print(f"Cannot read {folder}: {e}")
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.') and os.path.normcase(os.path.abspath(entry.path)) not in excluded:
+                    folders.append(entry.path)
+            elif entry.name.lower().endswith(extensions):
+                index.setdefault(normalize_name(entry.name), []).append(entry.path)
+    return index
+
+def match_converted(index, converted_paths):
+    """
+    Match converted files with their originals using an index built by build_original_index().
+
+    When several originals share a name, the ones with the extension of the converted file are preferred.
+
+    :param index: The index of the originals.
+    :param converted_paths: Paths of the converted files.
+    :return: A (pairs, problems) tuple. pairs is a list of (original path, converted path) tuples and problems
+             a list of (converted path, 'missing' or 'ambiguous', candidate paths) tuples.
+    """
+    pairs = []
+    problems = []
+    for converted_path in converted_paths:
+        candidates = index.get(normalize_name(converted_path), [])
+        if len(candidates) > 1:
+            extension = os.path.splitext(converted_path)[1].lower()
+            same_extension = [path for path in candidates if path.lower().endswith(extension)]
+            if len(same_extension) == 1:
+                candidates = same_extension
+        if len(candidates) == 1:
+            pairs.append((candidates[0], converted_path))
+        else:
+            problems.append((converted_path, 'ambiguous' if candidates else 'missing', sorted(candidates)))
+    return pairs, problems
+
+def list_videos(folder, extensions=VIDEO_EXTENSIONS):
+    """
+    List the videos of a single folder, sorted by name.
+
+    :param folder: The folder to list.
+    :param extensions: Extensions of the files to list, compared without case.
+    :return: The list of paths.
+    """
+    return sorted(entry.path for entry in os.scandir(folder)
+                  if entry.is_file() and entry.name.lower().endswith(extensions))
+
+def write_match_report(problems, report_file):
+    """
+    Write the converted files that could not be matched to a CSV file.
+
+    :param problems: The problems returned by match_converted().
+    :param report_file: Path to the CSV file to write.
+    """
+    with open(report_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Converted", "Problem", "Candidates"])
+        for converted_path, problem, candidates in problems:
+            writer.writerow([converted_path, problem, ';'.join(candidates)])
+
+def match_folder(original_root, converted_folder, report_file='match_report.csv'):
+    """
+    Match the videos of a converted folder with the originals of a tree and report the unmatched ones.
+
+    :param original_root: Root folder of the originals, searched recursively.
+    :param converted_folder: Folder of the converted videos. It is not indexed if it is inside the original tree.
+    :param report_file: Path to the CSV report written when some files are missing or ambiguous.
+    :return: The list of (original path, converted path) tuples.
+    """
+    index = build_original_index(original_root, exclude=[converted_folder])
+    pairs, problems = match_converted(index, list_videos(converted_folder))
+    if problems:
+        write_match_report(problems, report_file)
+        missing = sum(1 for _, problem, _ in problems if problem == 'missing')
+        print(f"{missing} converted files without original and {len(problems) - missing} ambiguous, "
+              f"see {report_file}")
+    return pairs
@@ -1,8 +1,183 @@
 import exiftool
 import os
 import csv
+import json
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import re
+import threading
+
+import avi_header
+import fingerprints
+import mp4_dates
+import original_index
+import stage_timings
+
+# Path to the exiftool executable, can be overridden with the EXIFTOOL_PATH environment variable
+EXIFTOOL_PATH = os.environ.get('EXIFTOOL_PATH', r'E:\outils\exiftool\exiftool(-k).exe')
+
+# ExifTool process shared by the helpers while an exiftool_session() is active
+_session = None
+
+# ExifTool processes sharing the writes of execute_write_plan() while an exiftool_pool() is active
+_pool = None
+
+# Time spent in each redating stage while an exiftool_timings() block is active
+_timings = None
+_timings_lock = threading.Lock()
+
+@contextmanager
+def exiftool_timings(report_file=None):
+    """
+    Accumulate the time spent in the exiftool calls and in the native file accesses made inside the block.
+
+    The stages are 'exiftool start', 'exiftool read' and 'exiftool write' for the exiftool processes,
+    'quicktime read' and 'quicktime patch' for the MP4/MOV headers and 'file times' for os.utime(). The
+    split is printed when the block ends.
+
+    :param report_file: JSON file where the seconds and calls of each stage are also written.
+    :return: The timings dictionary, see stage_timings.py.
+    """
+    global _timings
+    previous = _timings
+    timings = _timings = {}
+    try:
+        yield timings
+    finally:
+        _timings = previous
+        if previous is not None:
+            stage_timings.merge(previous, timings)
+        stage_timings.print_stage_split(timings, "Time by redating stage")
+        if report_file:
+            with open(report_file, 'w') as file:
+                json.dump({stage: {'seconds': seconds, 'calls': calls} for stage, (seconds, calls) in timings.items()},
+                          file, indent=2)
+
+def _timed(stage):
+    """
+    Time a block as a stage of the active exiftool_timings(), if any. Safe to use from several threads.
+    """
+    return stage_timings.timed(_timings, stage, _timings_lock)
+
+def _start_exiftool(executable=None):
+    """
+    Start an exiftool process in -stay_open mode.
+
+    On Linux the process is killed when the thread that started it exits, so it must be started from the
+    thread owning it.
+    """
+    et = exiftool.ExifToolHelper(executable=executable or EXIFTOOL_PATH)
+    with _timed('exiftool start'):
+        et.run()
+    return et
+
+@contextmanager
+def exiftool_session(executable=None):
+    """
+    Start a single exiftool process in -stay_open mode and use it for every helper called inside the block.
+
+    Without a session, each helper starts and stops its own exiftool process. Nested sessions reuse the
+    outer process.
+
+    :param executable: Path to the exiftool executable. Defaults to EXIFTOOL_PATH.
+    :return: The ExifToolHelper instance owning the process.
+    """
+    global _session
+    if _session is not None:
+        yield _session
+        return
+    et = _start_exiftool(executable)
+    _session = et
+    try:
+        yield et
+    finally:
+        _session = None
+        if et.running:
+            et.terminate()
+
+def _patch_quicktime_dates(filename, tags, create_date, modify_date, atoms):
+    """
+    Patch the QuickTime dates of an MP4/MOV file in place and return the tags left for ExifTool.
+
+    When the file cannot be patched natively, all the tags are returned so ExifTool writes them.
+
+    :param filename: Path to the video file.
+    :param tags: The tags that would be written with ExifTool.
+    :param create_date: The new creation date.
+    :param modify_date: The new modification date.
+    :param atoms: The atoms holding the QuickTime tags in the tags dictionary.
+    :return: A dictionary of the tags still to write.
+    """
+    try:
+        if filename.lower().endswith(('.mp4', '.mov')):
+            with _timed('quicktime patch'):
+                patched = mp4_dates.write_quicktime_dates(filename, create_date, modify_date, atoms)
+            if patched:
+                return {tag: value for tag, value in tags.items() if not tag.startswith('QuickTime:')}
+    except OSError:
+        # Let ExifTool report the missing or unreadable file
+        pass
+    return tags
+
+@contextmanager
+def exiftool_pool(workers, executable=None):
+    """
+    Start several exiftool processes in -stay_open mode and share the writes of execute_write_plan() between them.
+
+    One exiftool process only uses one core, so a pool lets a large plan use several cores and keep the disk busy.
+    The other helpers called inside the block use the first process of the pool. Nested pools reuse the outer one.
+
+    :param workers: Number of exiftool processes.
+    :param executable: Path to the exiftool executable. Defaults to EXIFTOOL_PATH.
+    :return: The list of ExifToolHelper instances owning the processes.
+    """
+    global _pool
+    if _pool is not None:
+        yield _pool
+        return
+    helpers = []
+    try:
+        for _ in range(max(1, workers)):
+            helpers.append(_start_exiftool(executable))
+        _pool = helpers
+        yield helpers
+    finally:
+        _pool = None
+        for et in helpers:
+            if et.running:
+                et.terminate()
+
+@contextmanager
+def _exiftool_workers(workers, executable=None):
+    """
+    Open an exiftool_pool() of workers processes, or a single exiftool_session() for one worker.
+    """
+    if workers > 1:
+        with exiftool_pool(workers, executable) as helpers:
+            yield helpers
+    else:
+        with exiftool_session(executable) as et:
+            yield [et]
+
+@contextmanager
+def _exiftool():
+    """
+    Return the active session, the first process of the active pool, or a short-lived ExifTool process.
+    """
+    if _session is not None:
+        yield _session
+    elif _pool is not None:
+        yield _pool[0]
+    else:
+        et = _start_exiftool()
+        try:
+            yield et
+        finally:
+            if et.running:
+                et.terminate()
 
 def get_video_tag(filename, tag):
     """
@@ -12,7 +187,7 @@ def get_video_tag(filename, tag):
     :param tag: The tag to retrieve.
     :return: The value of the specified tag.
     """
-    with exiftool.ExifToolHelper(executable=r'E:\outils\exiftool\exiftool(-k).exe') as et:
+    with _exiftool() as et, _timed('exiftool read'):
         tags = et.get_tags(filename, tag)
         return tags[0][tag]
 
@@ -23,7 +198,7 @@ def get_video_all_tags(filename):
     :param filename: Path to the video file.
     :return: A dictionary of all tags and their values.
     """
-    with exiftool.ExifToolHelper(executable=r'E:\outils\exiftool\exiftool(-k).exe') as et:
+    with _exiftool() as et, _timed('exiftool read'):
         all_tags = et.get_tags(filename, None)
         return all_tags
 
@@ -35,7 +210,7 @@ def set_video_tag(filename, tag, value):
     :param tag: The tag to set.
     :param value: The value to set for the tag.
     """
-    with exiftool.ExifToolHelper(executable=r'E:\outils\exiftool\exiftool(-k).exe') as et:
+    with _exiftool() as et, _timed('exiftool write'):
         et.set_tags(filename, {tag: value})
 
 def set_video_tags(filename, tags):
@@ -45,24 +220,40 @@ def set_video_tags(filename, tags):
     :param filename: Path to the video file.
     :param tags: A dictionary of tags and their values to set.
     """
-    with exiftool.ExifToolHelper(executable=r'E:\outils\exiftool\exiftool(-k).exe') as et:
+    with _exiftool() as et, _timed('exiftool write'):
         et.set_tags(filename, tags)
 
-def change_video_dates(filename, date):
+def change_video_dates(filename, date, skip_unchanged=False, overwrite_original=False):
     """
-    Change various date tags in a video file to a specified date using ExifTool.
+    Change various date tags in a video file to a specified date.
+
+    The QuickTime dates of MP4/MOV files are patched in place, the other tags are written using ExifTool.
 
     :param filename: Path to the video file.
     :param date: The new date to set.
-    """
+    :param skip_unchanged: Only write the tags that differ from the file (see diff_write_plan()).
+    :param overwrite_original: Do not keep the *_original backup.
+    :return: True if the file was written or already up to date.
+    """
+    if skip_unchanged or overwrite_original:
+        _, success, message = execute_write_plan([plan_video_dates_change(filename, date)],
+                                                 skip_unchanged=skip_unchanged,
+                                                 overwrite_original=overwrite_original)[0]
+        if not success:
+            print(f"Failed to update dates for {os.path.basename(filename)}: {message}")
+        return success
+
     date_str = date.strftime('%Y:%m:%d %H:%M:%S%z')
-    set_video_tags(filename, {'File:FileModifyDate': date_str, 'File:FileCreateDate': date_str, 
-                              'QuickTime:ModifyDate': date_str, 'QuickTime:CreateDate': date_str, 
-                              'QuickTime:MediaModifyDate': date_str, 'QuickTime:MediaCreateDate': date_str})
+    tags = {'File:FileModifyDate': date_str, 'File:FileCreateDate': date_str, 
+            'QuickTime:ModifyDate': date_str, 'QuickTime:CreateDate': date_str, 
+            'QuickTime:MediaModifyDate': date_str, 'QuickTime:MediaCreateDate': date_str}
+    set_video_tags(filename, _patch_quicktime_dates(filename, tags, date, date, (b'mvhd', b'mdhd')))
 
     date_tz = date.replace(tzinfo=None)  # Remove the timezone
     date_int = int(date_tz.timestamp())
-    os.utime(filename, (date_int, date_int))
+    with _timed('file times'):
+        os.utime(filename, (date_int, date_int))
+    return True
 
 def change_video_creation_date_by_date(filename, date):
     """
@@ -71,7 +262,7 @@ def change_video_creation_date_by_date(filename, date):
     :param filename: Path to the video file.
     :param date: The new creation date to set.
     """
-    with exiftool.ExifToolHelper(executable=r'E:\outils\exiftool\exiftool(-k).exe') as et:
+    with _exiftool() as et, _timed('exiftool write'):
         et.set_tags(filename, {'File:FileCreateDate': date})
     os.utime(filename, date)
 
@@ -82,45 +273,112 @@ def change_video_creation_date_by_offset(filename, offset):
     :param filename: Path to the video file.
     :param offset: The offset in days to adjust the creation date.
     """
-    with exiftool.ExifToolHelper(executable=r'E:\outils\exiftool\exiftool(-k).exe') as et:
-        tags = et.get_tags(filename, 'File:FileCreateDate')
+    with _exiftool() as et:
+        with _timed('exiftool read'):
+            tags = et.get_tags(filename, 'File:FileCreateDate')
         creation_date_str = tags[0]['File:FileCreateDate']
         creation_date_format = '%Y:%m:%d %H:%M:%S%z'
         creation_date = datetime.strptime(creation_date_str, creation_date_format)
         new_creation_date = creation_date + timedelta(days=offset)
         new_creation_date_str = new_creation_date.strftime('%Y:%m:%d %H:%M:%S%z')
         new_date = {'File:FileCreateDate': new_creation_date_str}
-        et.set_tags(filename, new_date)
+        with _timed('exiftool write'):
+            et.set_tags(filename, new_date)
         os.utime(filename, new_creation_date)
 
-def change_videos_creation_date_in_folder(folder_path, offset):
+def change_videos_creation_date_in_folder(folder_path, offset, workers=1):
     """
     Change the creation date of all video files in a folder by a specified offset using ExifTool.
 
+    The current creation dates are read with a single ExifTool call and the new ones written as one plan.
+
     :param folder_path: Path to the folder containing video files.
     :param offset: The offset in days to adjust the creation date, or a specific datetime.
+    :param workers: Number of exiftool processes writing the plan.
+    :return: A list of (filename, success, message) tuples, one per video file.
+    """
+    filenames = [os.path.join(folder_path, filename) for filename in os.listdir(folder_path)
+                 if filename.endswith('.mp4') or filename.endswith('.mov') or filename.endswith('.avi')]
+
+    with _exiftool_workers(workers):
+        if isinstance(offset, datetime):
+            new_dates = {filename: offset for filename in filenames}
+        else:
+            new_dates = {}
+            for filename, tags in zip(filenames, get_videos_tags(filenames, ['File:FileCreateDate'])):
+                creation_date = _parse_date(tags.get('File:FileCreateDate', ''))
+                if creation_date is None:
+                    print(f"No creation date for {os.path.basename(filename)}")
+                    continue
+                new_dates[filename] = creation_date + timedelta(days=offset)
+        plan = [plan_video_creation_date(filename, date) for filename, date in new_dates.items()]
+        results = execute_write_plan(plan)
+
+    for filename, success, message in results:
+        if not success:
+            print(f"Failed to update the creation date of {os.path.basename(filename)}: {message}")
+    return results
+
+def get_avi_capture_date(filename):
+    """
+    Retrieve the capture date of an AVI file from its RIFF header, without ExifTool.
+
+    :param filename: Path to the video file.
+    :return: The capture date formatted like the ExifTool dates, or None if the file has no readable capture date.
     """
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.mp4') or filename.endswith('.mov') or filename.endswith('.avi'):
-            full_path = os.path.join(folder_path, filename)
-            if isinstance(offset, datetime):
-                change_video_creation_date_by_date(full_path, offset)
-            else:
-                change_video_creation_date_by_offset(full_path, offset)
+    if not filename.lower().endswith('.avi'):
+        return None
+    try:
+        header = avi_header.read_avi_header(filename)
+    except (ValueError, OSError):
+        return None
+    if header['capture_time'] is None:
+        return None
+    # The camera stores local time, attach the local timezone like ExifTool does for the File dates
+    return header['capture_time'].astimezone().strftime('%Y:%m:%d %H:%M:%S%z')
+
+# Folders of the original and renamed files listed in the CSV file of batch_date_change()
+ORIGINAL_FOLDER = r'D:\temp\DCIM\100DSCIM\original'
+RENAMED_FOLDER = r'D:\photos\2022\camera_chasse'
+
+# Folder where batch_date_change() moves the *_original backups
+DONE_FOLDER = r'D:\temp\DCIM\100DSCIM\done'
 
 # From revert_names.py
+def get_old_path(csv_row, folder=ORIGINAL_FOLDER):
+    """
+    Build the path of the old (original) file from a CSV row.
+
+    :param csv_row: A row from the CSV file containing old and new file names.
+    :param folder: Folder of the old files.
+    :return: The path of the old file.
+    """
+    return os.path.join(folder, csv_row[0])
+
+def get_new_path(csv_row, folder=RENAMED_FOLDER):
+    """
+    Build the path of the new (renamed) file from a CSV row.
+
+    :param csv_row: A row from the CSV file containing old and new file names.
+    :param folder: Folder of the new files.
+    :return: The path of the new file.
+    """
+    return os.path.join(folder, csv_row[2])
+
 def get_old_date(csv_row):
     """
-    Retrieve the modification date of the old file based on the CSV row.
+    Retrieve the date of the old file based on the CSV row.
+
+    The capture date from the header is used for AVI files that have one, otherwise the modification date is read
+    using ExifTool.
 
     :param csv_row: A row from the CSV file containing old and new file names.
-    :return: The modification date of the old file.
+    :return: The date of the old file.
     """
-    old_name = csv_row[0]
-    old_name = os.path.join(r'D:\temp\DCIM\100DSCIM\original', old_name)
+    old_name = get_old_path(csv_row)
     if not os.path.exists(old_name):
         return None
-    old_date = get_video_tag(old_name, 'File:FileModifyDate')
+    old_date = get_avi_capture_date(old_name) or get_video_tag(old_name, 'File:FileModifyDate')
     return old_date
 
 def set_new_date(csv_row, new_date):
@@ -130,35 +388,73 @@ def set_new_date(csv_row, new_date):
     :param csv_row: A row from the CSV file containing old and new file names.
     :param new_date: The new date to set.
     """
-    new_name = csv_row[2]
-    new_name = os.path.join(r'D:\photos\2022\camera_chasse', new_name)
+    new_name = get_new_path(csv_row)
     if not os.path.exists(new_name):
         return None
     change_video_dates(new_name, new_date)
 
-def batch_date_change():
+def batch_date_change(skip_unchanged=True, overwrite_original=False, workers=1, csv_path="./renamed_files_new.csv",
+                      original_folder=ORIGINAL_FOLDER, renamed_folder=RENAMED_FOLDER, done_folder=DONE_FOLDER,
+                      offset_days=4206.32, dedup=False):
     """
     Batch process to change the dates of multiple video files based on a CSV file.
+
+    The capture dates of the old AVI files are read from their headers and the dates of the remaining old files with
+    a single ExifTool call, then the new dates are written in chunks.
+
+    :param skip_unchanged: Only touch the files whose dates differ, see diff_write_plan().
+    :param overwrite_original: Do not keep the *_original backups, so there is nothing to move to the done folder.
+    :param workers: Number of exiftool processes writing the plan.
+    :param csv_path: CSV file listing the old names in its first column and the new names in its third one.
+    :param original_folder: Folder of the old files.
+    :param renamed_folder: Folder of the new files.
+    :param done_folder: Folder where the *_original backups of the new files are moved.
+    :param offset_days: Number of days added to the dates of the old files.
+    :param dedup: Write the copies of new files already given the same dates without reading their tags first,
+                  see execute_write_plan().
+    :return: A list of (filename, success, message) tuples, one per written file.
     """
-    csv_path = "./renamed_files_new.csv"
     with open(csv_path, "r") as csvfile:
         reader = csv.reader(csvfile)
         next(reader)  # Skip the header row
-        for row in reader:
-            old_date_str = get_old_date(row)
+        rows = [row for row in reader if os.path.exists(get_old_path(row, original_folder))
+                and os.path.exists(get_new_path(row, renamed_folder))]
+
+    with _exiftool_workers(workers):
+        old_dates = {get_old_path(row, original_folder): get_avi_capture_date(get_old_path(row, original_folder))
+                     for row in rows}
+        missing = [old_path for old_path, old_date in old_dates.items() if old_date is None]
+        for old_path, tags in zip(missing, get_videos_tags(missing, ['File:FileModifyDate'])):
+            old_dates[old_path] = tags.get('File:FileModifyDate')
+
+        plan = []
+        for row in rows:
+            old_date_str = old_dates[get_old_path(row, original_folder)]
             if old_date_str is None:
+                print('Error with file ' + row[2] + ': no date on the old file')
                 continue
             old_date_format = '%Y:%m:%d %H:%M:%S%z'
             old_date = datetime.strptime(old_date_str, old_date_format)
-            offset_date = old_date + timedelta(days=4206.32)
-            try:
-                set_new_date(row, offset_date)
-                backup_fn = row[2] + '_original'
-                backup_name = os.path.join(r'D:\photos\2022\camera_chasse', backup_fn)
-                done_name = os.path.join(r'D:\temp\DCIM\100DSCIM\done', backup_fn)
+            offset_date = old_date + timedelta(days=offset_days)
+            plan.append(plan_video_dates_change(get_new_path(row, renamed_folder), offset_date))
+
+        results = execute_write_plan(plan, skip_unchanged=skip_unchanged, overwrite_original=overwrite_original,
+                                     dedup=dedup)
+
+    for filename, success, message in results:
+        if not success:
+            print('Error with file ' + filename + ': ' + message)
+            continue
+        try:
+            backup_fn = os.path.basename(filename) + '_original'
+            backup_name = filename + '_original'
+            done_name = os.path.join(done_folder, backup_fn)
+            # No backup is left when only the File tags were written by ExifTool
+            if os.path.exists(backup_name):
                 os.rename(backup_name, done_name)
-            except:
-                print('Error with file ' + row[2])
+        except OSError:
+            print('Error with file ' + filename)
+    return results
 
 def extract_datetime_from_filename(filename):
     """
@@ -190,16 +486,30 @@ def redate_video_file_by_filename(filepath):
     else:
         print(f"Filename {filename} does not match the expected pattern.")
 
-def redate_videos_in_folder_by_filename(folder_path):
+def redate_videos_in_folder_by_filename(folder_path, skip_unchanged=True, overwrite_original=False):
     """
     Update the metadata of all video files in a folder to match the dates and times in their filenames.
 
     :param folder_path: Path to the folder containing video files.
+    :param skip_unchanged: Only touch the files whose dates differ, see diff_write_plan().
+    :param overwrite_original: Do not keep the *_original backups.
+    :return: A list of (filename, success, message) tuples, one per file with a date in its name.
     """
+    plan = []
     for filename in os.listdir(folder_path):
         if filename.endswith('.mp4') or filename.endswith('.mov') or filename.endswith('.avi'):
-            full_path = os.path.join(folder_path, filename)
-            redate_video_file_by_filename(full_path)
+            file_datetime = extract_datetime_from_filename(filename)
+            if file_datetime:
+                plan.append(plan_video_dates_change(os.path.join(folder_path, filename), file_datetime))
+            else:
+                print(f"Filename {filename} does not match the expected pattern.")
+
+    with exiftool_session():
+        results = execute_write_plan(plan, skip_unchanged=skip_unchanged, overwrite_original=overwrite_original)
+    for filename, success, message in results:
+        if not success:
+            print(f"Failed to update dates for {os.path.basename(filename)}: {message}")
+    return results
 
 
 def get_video_dates(filename):
@@ -209,52 +519,481 @@ def get_video_dates(filename):
     :param filename: Path to the video file.
     :return: A dictionary with the creation and modification dates.
     """
-    with exiftool.ExifToolHelper(executable=r'E:\outils\exiftool\exiftool(-k).exe') as et:
+    with _exiftool() as et, _timed('exiftool read'):
         tags = et.get_tags(filename, ['File:FileCreateDate', 'File:FileModifyDate'])
         return {
             'create_date': tags[0].get('File:FileCreateDate'),
             'modify_date': tags[0].get('File:FileModifyDate')
         }
 
-def set_video_dates(filename, dates):
+def set_video_dates(filename, dates, skip_unchanged=False, overwrite_original=False):
     """
-    Set the creation and modification dates in a video file using ExifTool.
+    Set the creation and modification dates in a video file.
+
+    The QuickTime dates of MP4/MOV files are patched in place, the other tags are written using ExifTool.
 
     :param filename: Path to the video file.
     :param dates: A dictionary with the new creation and modification dates.
+    :param skip_unchanged: Only write the tags that differ from the file (see diff_write_plan()).
+    :param overwrite_original: Do not keep the *_original backup.
+    """
+    entry = plan_video_dates(filename, dates)
+    if skip_unchanged or overwrite_original:
+        _, success, message = execute_write_plan([entry], skip_unchanged=skip_unchanged,
+                                                 overwrite_original=overwrite_original)[0]
+        if not success:
+            raise OSError(f"Failed to update dates for {filename}: {message}")
+        return
+    tags = _patch_quicktime_dates(filename, entry['tags'], *entry['quicktime'])
+    with _exiftool() as et, _timed('exiftool write'):
+        et.set_tags(filename, tags)
+    # Adjust the OS-level file times
+    with _timed('file times'):
+        os.utime(filename, entry['times'])
+
+def get_videos_tags(filenames, tags):
+    """
+    Retrieve tags from many video files with a single ExifTool call.
+
+    :param filenames: List of paths to the video files. All files must exist.
+    :param tags: The tag or list of tags to retrieve.
+    :return: A list of tag dictionaries, in the same order as filenames.
+    """
+    if not filenames:
+        return []
+    with _exiftool() as et, _timed('exiftool read'):
+        return et.get_tags(filenames, tags)
+
+def get_videos_dates(filenames):
+    """
+    Retrieve the creation and modification dates of many video files with a single ExifTool call.
+
+    :param filenames: List of paths to the video files. All files must exist.
+    :return: A dictionary mapping each filename to its creation and modification dates.
     """
-    with exiftool.ExifToolHelper(executable=r'E:\outils\exiftool\exiftool(-k).exe') as et:
-        et.set_tags(filename, {
+    tags = get_videos_tags(filenames, ['File:FileCreateDate', 'File:FileModifyDate'])
+    return {
+        filename: {
+            'create_date': file_tags.get('File:FileCreateDate'),
+            'modify_date': file_tags.get('File:FileModifyDate')
+        }
+        for filename, file_tags in zip(filenames, tags)
+    }
+
+def plan_video_dates(filename, dates):
+    """
+    Build the write plan entry equivalent to set_video_dates() without touching the file.
+
+    :param filename: Path to the video file.
+    :param dates: A dictionary with the new creation and modification dates.
+    :return: A plan entry for execute_write_plan().
+    """
+    date_format = '%Y:%m:%d %H:%M:%S%z'
+    create_date = datetime.strptime(dates['create_date'], date_format)
+    modify_date = datetime.strptime(dates['modify_date'], date_format)
+    create_time = create_date.timestamp()
+    modify_time = modify_date.timestamp()
+    return {
+        'filename': filename,
+        'tags': {
             'File:FileCreateDate': dates['create_date'],
             'File:FileModifyDate': dates['modify_date'],
             'QuickTime:CreateDate': dates['create_date'],
             'QuickTime:ModifyDate': dates['modify_date']
-        })
-    # Adjust the OS-level file times
-    date_format = '%Y:%m:%d %H:%M:%S%z'
-    create_time = datetime.strptime(dates['create_date'], date_format).timestamp()
-    modify_time = datetime.strptime(dates['modify_date'], date_format).timestamp()
-    os.utime(filename, (modify_time, create_time))
+        },
+        'quicktime': (create_date, modify_date, (b'mvhd',)),
+        'times': (modify_time, create_time)
+    }
 
-def match_and_update_dates(original_folder, converted_folder):
+def plan_video_dates_change(filename, date):
     """
-    Match converted videos with their original counterparts by handling the replacement of underscores with spaces.
+    Build the write plan entry equivalent to change_video_dates() without touching the file.
+
+    :param filename: Path to the video file.
+    :param date: The new date to set.
+    :return: A plan entry for execute_write_plan().
     """
-    for converted_filename in os.listdir(converted_folder):
-        if converted_filename.lower().endswith(('.mp4', '.mov', '.avi')):
-            # Replace spaces with underscores and remove the "-x" suffix
-            base_name = re.sub(r'-\d+', '', converted_filename).replace(' ', '_').upper()
-            original_filename = base_name
+    date_str = date.strftime('%Y:%m:%d %H:%M:%S%z')
+    date_int = int(date.replace(tzinfo=None).timestamp())
+    return {
+        'filename': filename,
+        'tags': {'File:FileModifyDate': date_str, 'File:FileCreateDate': date_str,
+                 'QuickTime:ModifyDate': date_str, 'QuickTime:CreateDate': date_str,
+                 'QuickTime:MediaModifyDate': date_str, 'QuickTime:MediaCreateDate': date_str},
+        'quicktime': (date, date, (b'mvhd', b'mdhd')),
+        'times': (date_int, date_int)
+    }
 
-            original_path = os.path.join(original_folder, original_filename)
+def plan_video_creation_date(filename, date):
+    """
+    Build the write plan entry setting the creation date of a file and its OS-level times.
 
-            if os.path.exists(original_path):
-                converted_path = os.path.join(converted_folder, converted_filename)
-                dates = get_video_dates(original_path)
-                set_video_dates(converted_path, dates)
-                print(f"Updated dates for {converted_filename}")
+    :param filename: Path to the video file.
+    :param date: The new creation date.
+    :return: A plan entry for execute_write_plan().
+    """
+    date_time = date.timestamp()
+    return {
+        'filename': filename,
+        'tags': {'File:FileCreateDate': date.strftime('%Y:%m:%d %H:%M:%S%z')},
+        'times': (date_time, date_time)
+    }
+
+def _parse_date(value):
+    """
+    Parse an ExifTool date, with or without subseconds and timezone, or return None.
+    """
+    value = re.sub(r'\.\d+', '', str(value).strip())
+    for date_format in ('%Y:%m:%d %H:%M:%S%z', '%Y:%m:%d %H:%M:%S'):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    return None
+
+def _same_date(current, target):
+    """
+    Tell if two dates are the same, comparing wall-clock times when one of them has no timezone.
+    """
+    if current is None or target is None:
+        return False
+    if current.tzinfo is None or target.tzinfo is None:
+        return current.replace(tzinfo=None) == target.replace(tzinfo=None)
+    return current == target
+
+def diff_write_plan(plan):
+    """
+    Reduce a write plan to what differs from the current state of the files.
+
+    The QuickTime dates of MP4/MOV files are read natively and the other tags with a single ExifTool call
+    for the whole plan. File:FileModifyDate is left to os.utime() and compared with the file's modification
+    time. File:FileCreateDate is dropped when ExifTool does not report it, as on systems without creation
+    times where it cannot be written either, and so are the QuickTime tags of other containers than MP4/MOV,
+    such as AVI, which ExifTool can neither report nor write. A tag that cannot be read is considered different.
+
+    Each returned entry only keeps the tags to write. Entries with no tag left only need their OS-level
+    times adjusted, and entries already up to date are marked with 'unchanged'.
+
+    :param plan: A list of plan entries.
+    :return: The reduced plan, in the same order.
+    """
+    reduced = []
+    to_read = []
+    for entry in plan:
+        entry = dict(entry, tags=dict(entry['tags']))
+        entry['tags'].pop('File:FileModifyDate', None)
+        if not entry['filename'].lower().endswith(('.mp4', '.mov')):
+            entry.pop('quicktime', None)
+            entry['tags'] = {tag: value for tag, value in entry['tags'].items() if not tag.startswith('QuickTime:')}
+        elif 'quicktime' in entry:
+            with _timed('quicktime read'):
+                current = mp4_dates.read_quicktime_dates(entry['filename'])
+            create_date, modify_date, _ = entry['quicktime']
+            if current is not None:
+                if (_same_date(current['create_date'], create_date)
+                        and _same_date(current['modify_date'], modify_date)):
+                    del entry['quicktime']
+                    entry['tags'] = {tag: value for tag, value in entry['tags'].items()
+                                     if not tag.startswith('QuickTime:')}
+                else:
+                    # The dates are patched natively, ExifTool does not need to read them
+                    to_read.append((entry, [tag for tag in entry['tags'] if not tag.startswith('QuickTime:')]))
+                    reduced.append(entry)
+                    continue
+        to_read.append((entry, list(entry['tags'])))
+        reduced.append(entry)
+
+    to_read = [(entry, tags) for entry, tags in to_read if tags]
+    tag_names = sorted({tag for _, tags in to_read for tag in tags})
+    current_tags = get_videos_tags([entry['filename'] for entry, _ in to_read], tag_names) if tag_names else []
+    for (entry, tags), current in zip(to_read, current_tags):
+        for tag in tags:
+            if tag == 'File:FileCreateDate' and tag not in current:
+                del entry['tags'][tag]
+            elif tag in current and _same_date(_parse_date(current[tag]), _parse_date(entry['tags'][tag])):
+                del entry['tags'][tag]
+        if 'quicktime' in entry and not any(tag.startswith('QuickTime:') for tag in entry['tags']):
+            del entry['quicktime']
+
+    for entry in reduced:
+        if not entry['tags'] and 'quicktime' not in entry:
+            modify_time = os.stat(entry['filename']).st_mtime
+            if abs(modify_time - entry['times'][1]) < 1:
+                entry['unchanged'] = True
+    return reduced
+
+# Number of files written by a single ExifTool command
+WRITE_CHUNK_SIZE = 500
+
+# Largest output, in bytes, a single ExifTool command may print on stdout or stderr. PyExifTool writes the
+# whole command before reading any output, so a command printing more than the pipe can hold (4 KB on
+# Windows) would block both processes. Each file section prints its result line and "{ready}", plus an
+# error line naming the file when it fails.
+WRITE_OUTPUT_BUDGET = 4096
+SECTION_OUTPUT_SIZE = 80
+
+def _split_chunks(indexes, plan, chunk_size):
+    """
+    Split the plan entries to write in chunks of at most chunk_size files whose output fits in WRITE_OUTPUT_BUDGET.
+    """
+    chunks = []
+    chunk, output_size = [], 0
+    for i in indexes:
+        size = SECTION_OUTPUT_SIZE + len(plan[i]['filename'].encode('utf-8'))
+        if chunk and (len(chunk) >= chunk_size or output_size + size > WRITE_OUTPUT_BUDGET):
+            chunks.append(chunk)
+            chunk, output_size = [], 0
+        chunk.append(i)
+        output_size += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def _write_chunk(et, chunk, overwrite_original=False):
+    """
+    Write the tags of a chunk of plan entries with one ExifTool command.
+
+    Each file gets its own -execute section so that the values can differ per file, and the
+    "{ready}" marker printed after each section is used to tell which files were updated.
+
+    :param overwrite_original: Do not keep the *_original backups.
+    :return: A list of (filename, success, message) tuples.
+    """
+    params = []
+    for i, entry in enumerate(chunk):
+        if i > 0:
+            params.append('-execute')
+        if overwrite_original:
+            params.append('-overwrite_original')
+        params.extend(f'-{tag}={value}' for tag, value in entry['tags'].items())
+        params.append(entry['filename'])
+
+    try:
+        with _timed('exiftool write'):
+            stdout = et.execute(*params)
+    except exiftool.exceptions.ExifToolExecuteError as e:
+        # Only the status of the last section is reported, the output still covers every file
+        stdout = e.stdout
+
+    sections = stdout.split('{ready}')
+    if len(sections) != len(chunk):
+        return [(entry['filename'], False, 'unexpected exiftool output') for entry in chunk]
+
+    results = []
+    for entry, section in zip(chunk, sections):
+        # A file already holding the values is reported as "0 image files updated" then "1 image files unchanged"
+        counts = re.findall(r'(\d+) image files (updated|unchanged)', section)
+        done = [f'{count} image files {state}' for count, state in counts if int(count) > 0]
+        if done:
+            results.append((entry['filename'], True, done[0]))
+        else:
+            results.append((entry['filename'], False, section.strip() or 'not updated'))
+    return results
+
+def _set_times(result, entry):
+    """
+    Adjust the OS-level times of a successfully written file and return its updated result.
+    """
+    filename, success, message = result
+    if success:
+        try:
+            with _timed('file times'):
+                os.utime(filename, entry['times'])
+        except OSError as e:
+            return filename, False, str(e)
+    return result
+
+def execute_write_plan(plan, chunk_size=WRITE_CHUNK_SIZE, skip_unchanged=False, overwrite_original=False,
+                       dedup=False):
+    """
+    Apply a write plan built with plan_video_dates() or plan_video_dates_change().
+
+    The QuickTime dates of MP4/MOV files are patched in place, the remaining tags are written in
+    chunks of at most chunk_size files per ExifTool command (fewer when their output could fill the
+    pipe, see WRITE_OUTPUT_BUDGET), then the OS-level file times are adjusted for every file that was
+    written successfully.
+
+    :param plan: A list of plan entries.
+    :param chunk_size: The number of files per ExifTool command.
+    :param skip_unchanged: Compare the plan with the files first (see diff_write_plan()). Files already
+                           up to date are not touched and files with only wrong OS-level times are fixed
+                           with os.utime() alone, without ExifTool.
+    :param overwrite_original: Let ExifTool replace the files without keeping *_original backups.
+    :param dedup: Write the copies of a file without comparing them with the plan first, see
+                  _execute_deduplicated().
+    :return: A list of (filename, success, message) tuples, in the same order as the plan.
+
+    Inside an exiftool_pool(), the chunks are written by all the processes of the pool at the same time.
+    """
+    if dedup:
+        return _execute_deduplicated(plan, chunk_size, skip_unchanged, overwrite_original)
+    start_time = time.perf_counter()
+    if skip_unchanged:
+        plan = diff_write_plan(plan)
+
+    # Patch the QuickTime dates in place first so ExifTool only has to write what is left
+    plan = [dict(entry, tags=_patch_quicktime_dates(entry['filename'], entry['tags'], *entry['quicktime']))
+            if 'quicktime' in entry else entry for entry in plan]
+
+    results = {}
+    to_write = []
+    for i, entry in enumerate(plan):
+        if entry.get('unchanged'):
+            results[i] = (entry['filename'], True, 'unchanged')
+        elif not entry['tags']:
+            message = 'patched in place' if 'quicktime' in entry else 'times only'
+            results[i] = _set_times((entry['filename'], True, message), entry)
+        else:
+            to_write.append(i)
+
+    workers = len(_pool) if _pool is not None and _session is None else 1
+    if workers > 1:
+        # Smaller chunks so that every process gets several of them and none is left idle at the end
+        chunk_size = max(1, min(chunk_size, -(-len(to_write) // (workers * 4))))
+    chunks = _split_chunks(to_write, plan, chunk_size)
+
+    if workers > 1 and len(chunks) > 1:
+        idle = queue.Queue()
+        for et in _pool:
+            idle.put(et)
+
+        def write(indexes):
+            et = idle.get()
+            try:
+                return _write_chunk(et, [plan[i] for i in indexes], overwrite_original)
+            finally:
+                idle.put(et)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map() returns the chunks in order, whichever process finished first
+            for indexes, chunk_results in zip(chunks, executor.map(write, chunks)):
+                for i, result in zip(indexes, chunk_results):
+                    results[i] = _set_times(result, plan[i])
+    elif chunks:
+        with _exiftool() as et:
+            for indexes in chunks:
+                for i, result in zip(indexes, _write_chunk(et, [plan[i] for i in indexes], overwrite_original)):
+                    results[i] = _set_times(result, plan[i])
+
+    results = [results[i] for i in range(len(plan))]
+    _report_throughput(results, time.perf_counter() - start_time, workers)
+    return results
+
+def _record_written(conn, fingerprint, key, filename):
+    """
+    Add a file to the files written with the tags key among the copies of a fingerprint.
+
+    The file is also recorded under the fingerprint it has once written, since patching the QuickTime dates in
+    place changes the hashed bytes. A later run then finds it and compares it with the plan as usual.
+    """
+    path = os.path.abspath(filename)
+    try:
+        written_fingerprint = fingerprints.get_fingerprint(conn, path)
+    except OSError:
+        written_fingerprint = fingerprint
+    for each_fingerprint in dict.fromkeys([fingerprint, written_fingerprint]):
+        earlier = fingerprints.get_result(conn, each_fingerprint, 'dates', key)
+        paths = earlier[1]['paths'] if earlier is not None else []
+        if path not in paths:
+            fingerprints.store_result(conn, each_fingerprint, 'dates', key, paths[0] if paths else path,
+                                      {'paths': paths + [path]})
+
+def _execute_deduplicated(plan, chunk_size, skip_unchanged, overwrite_original):
+    """
+    Execute a write plan, writing the copies of a file without comparing them with the plan first.
+
+    The files are fingerprinted before they are written (see fingerprints.py). A copy of a file already
+    written with the same tags, earlier in the plan or in an earlier run, is in the state that file was in,
+    so the ExifTool read of diff_write_plan() is skipped and the whole plan entry is written to it. Its
+    result names the file it duplicates. The duplicate groups are written to duplicates.csv.
+    """
+    conn = fingerprints.open_index()
+    try:
+        results = {}
+        to_write = []
+        first_copies = {}
+        copies = []
+        for i, entry in enumerate(plan):
+            key = json.dumps(entry['tags'], sort_keys=True)
+            try:
+                fingerprint = fingerprints.get_fingerprint(conn, entry['filename'])
+            except OSError:
+                # Let the write report the missing or unreadable file
+                to_write.append((i, None, key))
+                continue
+            earlier = fingerprints.get_result(conn, fingerprint, 'dates', key)
+            if earlier is not None and os.path.abspath(entry['filename']) not in earlier[1]['paths']:
+                copies.append((i, fingerprint, key, earlier[1]['paths'][0]))
+            elif earlier is None and (fingerprint, key) in first_copies:
+                source = os.path.abspath(plan[first_copies[fingerprint, key]]['filename'])
+                copies.append((i, fingerprint, key, source))
             else:
-                print(f"Original file {original_filename} not found for {converted_filename}")
+                first_copies.setdefault((fingerprint, key), i)
+                to_write.append((i, fingerprint, key))
+
+        written = execute_write_plan([plan[i] for i, _, _ in to_write], chunk_size, skip_unchanged, overwrite_original)
+        for (i, fingerprint, key), result in zip(to_write, written):
+            results[i] = result
+            if result[1] and fingerprint is not None:
+                _record_written(conn, fingerprint, key, result[0])
+        written = execute_write_plan([plan[i] for i, _, _, _ in copies], chunk_size, False, overwrite_original)
+        for (i, fingerprint, key, source), (filename, success, message) in zip(copies, written):
+            if success:
+                _record_written(conn, fingerprint, key, filename)
+                message = f'{message}, duplicate of {source}'
+            results[i] = (filename, success, message)
+        fingerprints.write_duplicates_report(conn, [entry['filename'] for entry in plan])
+    finally:
+        conn.close()
+    return [results[i] for i in range(len(plan))]
+
+def _report_throughput(results, elapsed, workers):
+    """
+    Print how many files a write plan touched and how fast.
+    """
+    if not results:
+        return
+    counts = {}
+    for _, success, message in results:
+        state = 'failed' if not success else message if message in ('unchanged', 'times only') else 'written'
+        counts[state] = counts.get(state, 0) + 1
+    details = ', '.join(f'{count} {state}' for state, count in counts.items())
+    print(f"{len(results)} files in {elapsed:.2f} s ({len(results) / max(elapsed, 1e-9):.1f} files/s, "
+          f"{workers} exiftool process{'es' if workers > 1 else ''}): {details}")
+
+def match_and_update_dates(original_folder, converted_folder, skip_unchanged=True, overwrite_original=False, workers=1,
+                           report_file='match_report.csv', dedup=False):
+    """
+    Match converted videos with their original counterparts by handling the replacement of underscores with spaces.
+
+    The original folder is indexed once, subfolders included, and the converted files are matched in memory
+    (see original_index.py). The dates of all the originals are read with a single ExifTool call and written to
+    the converted files in chunks.
+
+    :param original_folder: Root folder of the originals, such as the DCIM folder holding 100MEDIA, 101MEDIA, ...
+    :param converted_folder: Folder of the converted videos.
+    :param skip_unchanged: Only touch the converted files whose dates differ, see diff_write_plan().
+    :param overwrite_original: Do not keep the *_original backups.
+    :param workers: Number of exiftool processes writing the plan.
+    :param report_file: CSV file listing the converted files without original or with several candidates.
+    :param dedup: Write the copies of converted files already given the same dates without reading their tags
+                  first, see execute_write_plan().
+    :return: A list of (filename, success, message) tuples, one per converted file that has an original.
+    """
+    pairs = original_index.match_folder(original_folder, converted_folder, report_file)
+
+    with _exiftool_workers(workers):
+        dates = get_videos_dates([original_path for original_path, _ in pairs])
+        plan = [plan_video_dates(converted_path, dates[original_path]) for original_path, converted_path in pairs]
+        results = execute_write_plan(plan, skip_unchanged=skip_unchanged, overwrite_original=overwrite_original,
+                                     dedup=dedup)
+
+    for converted_path, success, message in results:
+        if success:
+            print(f"Updated dates for {os.path.basename(converted_path)}")
+        else:
+            print(f"Failed to update dates for {os.path.basename(converted_path)}: {message}")
+    return results
 
 
 def main():
@@ -1,5 +1,6 @@
 import csv
 import os
+import sys
 
 # Define the path to the CSV file containing the old and new file names
 
@@ -14,11 +15,13 @@ def revert_names(csv_path):
             # Get the old and new file names
             old_name = row[0]
             new_name = row[1]
-            # Rename the file back to its old name
-            os.rename(new_name, old_name)
+            # Rename the file back to its old name (the manifest of ingest.py also lists the files it did not rename)
+            if new_name != old_name:
+                os.rename(new_name, old_name)
 
 def main():
-    csv_path = "./renamed_files.csv"
+    # Also accepts the manifest written by ingest.py, whose first two columns are the old and new paths
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else "./renamed_files.csv"
     revert_names(csv_path)
 
 if __name__ == "__main__":
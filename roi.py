@@ -0,0 +1,87 @@
+"""
+Per-camera regions of interest for the motion scanner.
+
+The regions are defined in a JSON file such as:
+
+    {
+        "cameras": [
+            {
+                "name": "feeder",
+                "folders": ["D:/temp/DCIM/100DSCIM"],
+                "prefixes": ["FEEDER_"],
+                "polygon": [[0, 0], [1280, 0], [1280, 650], [0, 650]]
+            }
+        ]
+    }
+
+A clip uses the first camera whose folders contain its folder (a full path or the last folder names)
+or whose prefixes start its filename. The polygon is in pixels of the native frame. Frames are cropped
+to the bounding box of the polygon and the motion outside the polygon is ignored.
+"""
+
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+
+def load_roi_config(path):
+    """
+    Load the camera regions of interest from a JSON file.
+
+    :param path: Path to the JSON file.
+    :return: The list of cameras.
+    """
+    with open(path, 'r') as file:
+        return json.load(file)['cameras']
+
+def config_key(cameras):
+    """
+    Build a short key identifying a set of cameras, so results computed with other regions are not reused.
+
+    :param cameras: The list of cameras.
+    :return: A hexadecimal string.
+    """
+    return hashlib.sha1(json.dumps(cameras, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+def _normalize_folder(folder):
+    """
+    Normalize a folder path so paths written with / or \\ compare equal.
+    """
+    return os.path.normcase(os.path.normpath(folder.replace('\\', '/')))
+
+def find_roi(cameras, filepath):
+    """
+    Find the region of interest of a clip.
+
+    :param cameras: The list of cameras.
+    :param filepath: Path to the clip.
+    :return: A dictionary with the crop (x, y, width, height) and the polygon, or None if no camera matches.
+    """
+    folder = _normalize_folder(os.path.abspath(os.path.dirname(filepath)))
+    filename = os.path.basename(filepath)
+    for camera in cameras:
+        folders = [_normalize_folder(camera_folder) for camera_folder in camera.get('folders', [])]
+        in_folder = any(folder == camera_folder or folder.endswith(os.sep + camera_folder) for camera_folder in folders)
+        has_prefix = any(filename.startswith(prefix) for prefix in camera.get('prefixes', []))
+        if in_folder or has_prefix:
+            polygon = [tuple(point) for point in camera['polygon']]
+            x, y, width, height = cv2.boundingRect(np.array(polygon, dtype=np.int32))
+            return {'crop': (x, y, width, height), 'polygon': polygon}
+    return None
+
+def roi_mask(roi, shape, scale=1.0):
+    """
+    Build the mask of the polygon inside the cropped (and scaled) frame.
+
+    :param roi: The region of interest returned by find_roi.
+    :param shape: The shape of the cropped and scaled frames.
+    :param scale: The scale applied to the frames after cropping.
+    :return: A uint8 mask, 255 inside the polygon and 0 outside.
+    """
+    x, y, _, _ = roi['crop']
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    points = (np.array(roi['polygon'], dtype=np.float64) - (x, y)) * scale
+    cv2.fillPoly(mask, [np.round(points).astype(np.int32)], 255)
+    return mask
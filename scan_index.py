@@ -0,0 +1,116 @@
+"""
+Persistent index of motion scan results.
+
+The index is an SQLite database stored in the scanned folder. Each clip is keyed by its name, size,
+modification time and the detector parameters, so a later scan only has to process the clips that were
+added or changed since, and an interrupted scan resumes where it stopped.
+"""
+
+import json
+import os
+import sqlite3
+
+# Name of the index database created in each scanned folder
+INDEX_FILENAME = '.mvmt_index.sqlite'
+
+def detector_params(**params):
+    """
+    Build the key identifying the detector parameters of a scan.
+
+    A whole threshold is stored as an integer, so a threshold of 1000.0 read from the command line gives the
+    same key as the default of 1000.
+
+    :param params: The parameters that change the verdict (threshold, frame_stride, scale, ...).
+    :return: A string usable as the params column of the index.
+    """
+    threshold = params.get('threshold')
+    if isinstance(threshold, float) and threshold.is_integer():
+        params['threshold'] = int(threshold)
+    return json.dumps(params, sort_keys=True)
+
+def open_index(folder_path):
+    """
+    Open (and create if needed) the scan index of a folder.
+
+    :param folder_path: Path to the scanned folder.
+    :return: An sqlite3 connection to the index.
+    """
+    conn = sqlite3.connect(os.path.join(folder_path, INDEX_FILENAME))
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS clips (
+            name TEXT NOT NULL,
+            params TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            motion INTEGER NOT NULL,
+            details TEXT,
+            PRIMARY KEY (name, params)
+        )''')
+    # Indexes created before the details column was added
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(clips)')]
+    if 'details' not in columns:
+        conn.execute('ALTER TABLE clips ADD COLUMN details TEXT')
+    conn.commit()
+    return conn
+
+def _to_result(motion, details):
+    """
+    Build a scan result dictionary from an index row.
+    """
+    result = json.loads(details) if details else {}
+    result['motion'] = bool(motion)
+    return result
+
+def get_result(conn, filepath, params):
+    """
+    Retrieve the stored result of a clip if the clip did not change since it was scanned.
+
+    :param conn: The index connection.
+    :param filepath: Path to the clip.
+    :param params: The detector parameters key.
+    :return: The result dictionary if the clip is indexed and unchanged, None otherwise.
+    """
+    stat = os.stat(filepath)
+    row = conn.execute('SELECT size, mtime_ns, motion, details FROM clips WHERE name = ? AND params = ?',
+                       (os.path.basename(filepath), params)).fetchone()
+    if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+        return None
+    return _to_result(row[2], row[3])
+
+def store_result(conn, filepath, params, result):
+    """
+    Store the result of a clip. The change is committed right away so an interrupted scan can resume.
+
+    :param conn: The index connection.
+    :param filepath: Path to the clip.
+    :param params: The detector parameters key.
+    :param result: The result dictionary, with the motion verdict and any other detail of the scan.
+    """
+    stat = os.stat(filepath)
+    details = {key: value for key, value in result.items() if key != 'motion'}
+    conn.execute('INSERT OR REPLACE INTO clips (name, params, size, mtime_ns, motion, details) VALUES (?, ?, ?, ?, ?, ?)',
+                 (os.path.basename(filepath), params, stat.st_size, stat.st_mtime_ns, int(result['motion']),
+                  json.dumps(details) if details else None))
+    conn.commit()
+
+def read_results(index_path, params=None):
+    """
+    Read the results stored in an index, sorted by filename.
+
+    :param index_path: Path to the index database.
+    :param params: Only return the results for these detector parameters. Defaults to the most recently stored ones.
+    :return: A list of (filepath, result) tuples.
+    """
+    folder_path = os.path.dirname(index_path)
+    conn = sqlite3.connect(index_path)
+    try:
+        if params is None:
+            row = conn.execute('SELECT params FROM clips ORDER BY rowid DESC LIMIT 1').fetchone()
+            if row is None:
+                return []
+            params = row[0]
+        rows = conn.execute('SELECT name, motion, details FROM clips WHERE params = ? ORDER BY name',
+                            (params,)).fetchall()
+    finally:
+        conn.close()
+    return [(os.path.join(folder_path, name), _to_result(motion, details)) for name, motion, details in rows]
@@ -0,0 +1,199 @@
+"""
+Per-stage timings of the scanner and of the redating scripts, to find where the time of a long run goes.
+
+A timings dictionary maps each stage name to a [seconds, calls] list, a stage only appearing once it ran.
+Wrapping a function or an iterator with a timings dictionary of None returns it unchanged, so the hooks cost
+nothing when they are disabled; when enabled they add two perf_counter() calls per call of the stage.
+"""
+
+import csv
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+def add(timings, stage, seconds, calls=1):
+    """
+    Add time spent in a stage.
+
+    :param timings: The timings dictionary.
+    :param stage: Name of the stage.
+    :param seconds: The time spent.
+    :param calls: The number of calls it was spent in.
+    """
+    total = timings.get(stage)
+    if total is None:
+        timings[stage] = [seconds, calls]
+    else:
+        total[0] += seconds
+        total[1] += calls
+
+def timed_function(timings, stage, function):
+    """
+    Wrap a function so the time spent in it is added to a stage.
+
+    :param timings: The timings dictionary, or None to leave the function unchanged.
+    :param stage: Name of the stage.
+    :param function: The function to wrap.
+    :return: The wrapped function.
+    """
+    if timings is None:
+        return function
+    clock = time.perf_counter
+    total = None
+
+    def wrapper(*args, **kwargs):
+        nonlocal total
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if total is None:
+                total = timings.setdefault(stage, [0.0, 0])
+            total[0] += clock() - start
+            total[1] += 1
+    return wrapper
+
+def timed_iterator(timings, stage, iterator):
+    """
+    Wrap an iterator, such as the frames of a clip, so the time spent waiting for each item is added to a stage.
+
+    Closing the wrapper closes the iterator.
+
+    :param timings: The timings dictionary, or None to leave the iterator unchanged.
+    :param stage: Name of the stage, its calls counting the items.
+    :param iterator: The iterator to wrap.
+    :return: The wrapped iterator.
+    """
+    if timings is None:
+        return iterator
+    clock = time.perf_counter
+
+    def wrapper():
+        total = timings.setdefault(stage, [0.0, 0])
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    total[0] += clock() - start
+                    return
+                total[0] += clock() - start
+                total[1] += 1
+                yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+    return wrapper()
+
+@contextmanager
+def _timed_block(timings, stage, lock):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with lock or nullcontext():
+            add(timings, stage, seconds)
+
+def timed(timings, stage, lock=None):
+    """
+    Context manager adding the time spent in its block to a stage.
+
+    :param timings: The timings dictionary, or None to time nothing.
+    :param stage: Name of the stage.
+    :param lock: Lock held while the time is added, when several threads share the timings.
+    :return: The context manager.
+    """
+    if timings is None:
+        return nullcontext()
+    return _timed_block(timings, stage, lock)
+
+def merge(total, timings):
+    """
+    Add the stages of a timings dictionary to another one.
+    """
+    for stage, (seconds, calls) in timings.items():
+        add(total, stage, seconds, calls)
+
+def clip_record(filepath, seconds, timings, frame_stage='decode'):
+    """
+    Build the timing record of a clip.
+
+    :param filepath: Path to the clip.
+    :param seconds: Total time spent on the clip.
+    :param timings: The timings dictionary of the clip.
+    :param frame_stage: The stage whose calls count the decoded frames.
+    :return: A dictionary with the filename, size, frames, total seconds and seconds per stage. The time not
+             spent in any stage is reported as 'other'.
+    """
+    stages = {stage: seconds_calls[0] for stage, seconds_calls in timings.items()}
+    stages['other'] = max(0.0, seconds - sum(stages.values()))
+    try:
+        size = os.path.getsize(filepath)
+    except OSError:
+        size = None
+    return {'filename': filepath, 'bytes': size, 'frames': timings.get(frame_stage, [0.0, 0])[1],
+            'seconds': seconds, 'stages': stages}
+
+def write_records(path, records):
+    """
+    Write clip timing records to a JSON file, or to a CSV file with one column per stage if path ends with .csv.
+
+    :param path: Path to the file to write.
+    :param records: The records built by clip_record().
+    """
+    if path.lower().endswith('.csv'):
+        stages = sorted({stage for record in records for stage in record['stages']})
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Filename', 'Bytes', 'Frames', 'Seconds'] + stages)
+            for record in records:
+                writer.writerow([record['filename'], record['bytes'], record['frames'], f"{record['seconds']:.6f}"]
+                                + [f"{record['stages'].get(stage, 0.0):.6f}" for stage in stages])
+        return
+    with open(path, 'w') as file:
+        json.dump(records, file, indent=2)
+
+def print_stage_split(timings, title="Time by stage"):
+    """
+    Print the time of each stage, the slowest first.
+
+    :param timings: The timings dictionary.
+    :param title: Title printed above the stages.
+    """
+    total = sum(seconds for seconds, _ in timings.values())
+    print(f"{title}:")
+    for stage, (seconds, calls) in sorted(timings.items(), key=lambda item: -item[1][0]):
+        per_call = f"  ({calls} calls, {seconds / calls * 1000:.2f} ms/call)" if calls else ''
+        print(f"  {stage:<16} {seconds:>9.2f} s {seconds / max(total, 1e-9):>6.1%}{per_call}")
+
+def print_summary(records, elapsed, slowest=5):
+    """
+    Print the summary of a scan: frames per second, time split by stage and slowest clips.
+
+    :param records: The records built by clip_record().
+    :param elapsed: Wall-clock time of the whole scan, in seconds.
+    :param slowest: Number of slowest clips listed.
+    """
+    if not records:
+        print("No clip was scanned, no timings to report")
+        return
+    frames = sum(record['frames'] for record in records)
+    clip_seconds = sum(record['seconds'] for record in records)
+    read = sum(record['bytes'] or 0 for record in records)
+    print(f"\n{len(records)} clips, {frames} frames in {elapsed:.1f} s: {frames / max(elapsed, 1e-9):.1f} frames/s, "
+          f"{read / 2 ** 20 / max(elapsed, 1e-9):.1f} MB/s read "
+          f"({frames / max(clip_seconds, 1e-9):.1f} frames/s per clip)")
+    totals = {}
+    for record in records:
+        for stage, seconds in record['stages'].items():
+            add(totals, stage, seconds, 0)
+    print_stage_split(totals)
+    print("Slowest clips:")
+    for record in sorted(records, key=lambda record: -record['seconds'])[:slowest]:
+        rate = record['frames'] / max(record['seconds'], 1e-9)
+        stage = max(record['stages'], key=record['stages'].get)
+        print(f"  {os.path.basename(record['filename']):<32} {record['seconds']:>7.2f} s {record['frames']:>6} frames "
+              f"{rate:>7.1f} frames/s, mostly {stage}")
@@ -0,0 +1,101 @@
+"""
+Generate synthetic trail camera clips with a known ground truth, to measure the speed and the accuracy
+of the motion detector.
+"""
+
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+def write_clip(path, frame_count=90, size=(320, 240), fps=30, blob=None, noise=0, seed=0):
+    """
+    Write a synthetic clip: a static textured scene, optionally with sensor noise and a moving blob.
+
+    :param path: Path of the clip to write. The extension selects the container (.avi or .mp4).
+    :param frame_count: Number of frames of the clip.
+    :param size: The (width, height) of the frames.
+    :param fps: The frame rate of the clip.
+    :param blob: None for a static scene, or a (width, height, first frame, last frame) tuple describing
+                 a white blob crossing the scene from left to right.
+    :param noise: Standard deviation of the Gaussian noise added to every frame.
+    :param seed: Seed of the random scene and noise.
+    """
+    width, height = size
+    fourcc = cv2.VideoWriter_fourcc(*('mp4v' if path.lower().endswith('.mp4') else 'MJPG'))
+    writer = cv2.VideoWriter(path, fourcc, fps, size)
+    rng = np.random.default_rng(seed)
+    # Blurred random texture so the scene looks like foliage rather than pure noise
+    scene = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (7, 7), 0)
+    try:
+        for i in range(frame_count):
+            frame = scene.copy()
+            if blob is not None:
+                blob_width, blob_height, first, last = blob
+                if first <= i <= last:
+                    progress = (i - first) / max(1, last - first)
+                    x = int(progress * (width - blob_width))
+                    y = (height - blob_height) // 2
+                    cv2.rectangle(frame, (x, y), (x + blob_width, y + blob_height), (255, 255, 255), -1)
+            if noise:
+                frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+            writer.write(frame)
+    finally:
+        writer.release()
+
+# Cases written by generate_clips(): name, blob as (width, height, first frame, last frame) in fractions of the
+# frame size and of the clip length (None for no blob), noise standard deviation and expected verdict
+CASES = [
+    ('static', None, 0, False),
+    ('noise', None, 4, False),
+    ('small_blob', (1 / 16, 1 / 16, 1 / 3, 2 / 3), 0, False),
+    ('large_blob', (1 / 5, 1 / 3, 1 / 3, 2 / 3), 0, True),
+    ('large_blob_noise', (1 / 5, 1 / 3, 1 / 3, 2 / 3), 4, True),
+    ('late_blob', (1 / 5, 1 / 3, 2 / 3, 1), 0, True),
+]
+
+def generate_clips(folder_path, extension='.AVI', size=(320, 240), fps=30, frame_count=90, cases=CASES, repeat=1):
+    """
+    Write a set of synthetic clips covering the usual trail camera cases.
+
+    :param folder_path: Folder where the clips are written.
+    :param extension: Extension (container) of the clips.
+    :param size: The (width, height) of the frames.
+    :param fps: The frame rate of the clips.
+    :param frame_count: Number of frames of each clip.
+    :param cases: The cases to write, see CASES.
+    :param repeat: Number of times each case is written, with a different random scene each time.
+    :return: A dictionary mapping each clip path to True if it contains motion.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    width, height = size
+    truth = {}
+    for i in range(repeat * len(cases)):
+        name, blob, noise, motion = cases[i % len(cases)]
+        if blob is not None:
+            blob_width, blob_height, first, last = blob
+            blob = (int(width * blob_width), int(height * blob_height),
+                    int(frame_count * first), min(int(frame_count * last), frame_count - 1))
+        path = os.path.join(folder_path, f'PICT{i + 1:04d}_{name}{extension}')
+        write_clip(path, frame_count, size, fps, blob, noise, seed=i)
+        truth[path] = motion
+    return truth
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic trail camera clips with a known ground truth")
+    parser.add_argument('folder', help="Folder where the clips are written")
+    parser.add_argument('--extension', default='.AVI', help="Extension (container) of the clips: .AVI or .mp4")
+    parser.add_argument('--size', default='320x240', help="Frame size as WIDTHxHEIGHT (default: 320x240)")
+    parser.add_argument('--fps', type=float, default=30, help="Frame rate (default: 30)")
+    parser.add_argument('--frames', type=int, default=90, help="Frames per clip (default: 90)")
+    parser.add_argument('--repeat', type=int, default=1, help="Number of clips written per case (default: 1)")
+    args = parser.parse_args()
+
+    size = tuple(int(value) for value in args.size.lower().split('x'))
+    truth = generate_clips(args.folder, args.extension, size, args.fps, args.frames, repeat=args.repeat)
+    for path, motion in truth.items():
+        print(f"{path}: {'motion' if motion else 'no motion'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Thumbnails of the peak motion frame of each clip, and contact sheets built from them.
+
+While scanning, movement_scan keeps the frame with the largest moving blob and saves it as a small JPEG
+in a .mvmt_thumbs folder next to the clips, one subfolder per set of detector parameters. The contact
+sheets tile these thumbnails in pages, so hundreds of flagged clips can be triaged from still images
+and only the interesting ones opened in the player.
+"""
+
+import argparse
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+# Folder created next to the clips to hold their thumbnails
+THUMBNAILS_FOLDER = '.mvmt_thumbs'
+
+# Width of the saved thumbnails, in pixels
+THUMBNAIL_WIDTH = 320
+
+def thumbnails_folder(folder_path, params):
+    """
+    Build the path of the folder holding the thumbnails computed with a set of detector parameters.
+
+    :param folder_path: Path to the folder containing the clips.
+    :param params: The detector parameters key (see scan_index.detector_params).
+    :return: The path of the thumbnails folder.
+    """
+    key = hashlib.sha1(params.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(folder_path, THUMBNAILS_FOLDER, key)
+
+def thumbnail_path(filepath, params):
+    """
+    Build the path of the thumbnail of a clip.
+
+    :param filepath: Path to the clip.
+    :param params: The detector parameters key.
+    :return: The path of the .jpg thumbnail.
+    """
+    folder_path, filename = os.path.split(filepath)
+    return os.path.join(thumbnails_folder(folder_path, params), filename + '.jpg')
+
+def save_thumbnail(path, frame, width=THUMBNAIL_WIDTH, quality=80):
+    """
+    Save a frame as a small JPEG thumbnail.
+
+    :param path: Path of the thumbnail.
+    :param frame: The BGR frame.
+    :param width: Width of the thumbnail. Smaller frames are not enlarged.
+    :param quality: JPEG quality.
+    """
+    if frame.shape[1] > width:
+        frame = cv2.resize(frame, (width, round(frame.shape[0] * width / frame.shape[1])),
+                           interpolation=cv2.INTER_AREA)
+    ok, data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode the thumbnail " + path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so an interrupted scan never leaves a truncated image
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(data.tobytes())
+    os.replace(tmp_path, path)
+
+def _latest_thumbnails_folder(folder_path):
+    """
+    Find the most recently written thumbnails folder of a folder of clips, or None.
+    """
+    root = os.path.join(folder_path, THUMBNAILS_FOLDER)
+    if not os.path.isdir(root):
+        return None
+    folders = [entry.path for entry in os.scandir(root) if entry.is_dir()]
+    return max(folders, key=os.path.getmtime, default=None)
+
+def _tile(thumbnail, label, cell_size):
+    """
+    Fit a thumbnail in a cell, keeping its aspect ratio, with its label below.
+    """
+    cell_width, cell_height = cell_size
+    label_height = 20
+    tile = np.zeros((cell_height + label_height, cell_width, 3), dtype=np.uint8)
+    ratio = min(cell_width / thumbnail.shape[1], cell_height / thumbnail.shape[0])
+    width, height = max(1, round(thumbnail.shape[1] * ratio)), max(1, round(thumbnail.shape[0] * ratio))
+    x, y = (cell_width - width) // 2, (cell_height - height) // 2
+    tile[y:y + height, x:x + width] = cv2.resize(thumbnail, (width, height), interpolation=cv2.INTER_AREA)
+    cv2.putText(tile, label, (4, cell_height + 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1, cv2.LINE_AA)
+    return tile
+
+def build_contact_sheets(folder_path, output_folder='contact_sheets', params=None, columns=5, rows=4,
+                         cell_size=(THUMBNAIL_WIDTH, 240)):
+    """
+    Tile the thumbnails of a folder in pages of columns x rows, sorted by clip name.
+
+    :param folder_path: Path to the folder containing the clips.
+    :param output_folder: Folder where the contact sheets are written.
+    :param params: Only use the thumbnails of these detector parameters. Defaults to the most recent ones.
+    :param columns: Number of thumbnails per row.
+    :param rows: Number of rows per page.
+    :param cell_size: The (width, height) of each thumbnail in the sheet.
+    :return: The list of paths of the contact sheets written.
+    """
+    folder = thumbnails_folder(folder_path, params) if params is not None else _latest_thumbnails_folder(folder_path)
+    if folder is None or not os.path.isdir(folder):
+        return []
+    filenames = sorted(name for name in os.listdir(folder) if name.endswith('.jpg'))
+
+    os.makedirs(output_folder, exist_ok=True)
+    per_page = columns * rows
+    sheets = []
+    for page, first in enumerate(range(0, len(filenames), per_page)):
+        tiles = []
+        for filename in filenames[first:first + per_page]:
+            thumbnail = cv2.imread(os.path.join(folder, filename))
+            if thumbnail is None:
+                continue
+            tiles.append(_tile(thumbnail, filename[:-len('.jpg')], cell_size))
+        if not tiles:
+            continue
+        blank = np.zeros_like(tiles[0])
+        tiles += [blank] * (-len(tiles) % columns)
+        sheet = np.vstack([np.hstack(tiles[i:i + columns]) for i in range(0, len(tiles), columns)])
+        sheet_path = os.path.join(output_folder, f'contact_sheet_{page + 1:03d}.jpg')
+        cv2.imwrite(sheet_path, sheet)
+        sheets.append(sheet_path)
+    return sheets
+
+def main():
+    parser = argparse.ArgumentParser(description="Build contact sheets from the motion thumbnails of a folder")
+    parser.add_argument('folder', help="Folder of clips scanned with --thumbnails")
+    parser.add_argument('--output', default='contact_sheets', help="Folder where the sheets are written")
+    parser.add_argument('--columns', type=int, default=5, help="Thumbnails per row (default: 5)")
+    parser.add_argument('--rows', type=int, default=4, help="Rows per sheet (default: 4)")
+    args = parser.parse_args()
+
+    sheets = build_contact_sheets(args.folder, args.output, columns=args.columns, rows=args.rows)
+    if not sheets:
+        print("No thumbnails found in " + args.folder + ", scan it with --thumbnails first")
+    for sheet in sheets:
+        print("Wrote " + sheet)
+
+if __name__ == "__main__":
+    main()